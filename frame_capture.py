@@ -0,0 +1,159 @@
+"""Asynchronous, low-copy readback of rgba32f compute-shader output.
+
+Reading an rgba32f texture with `Texture.read()` stalls until the GPU is idle
+and returns a fresh 16-bytes-per-pixel bytes object.  `FrameCapture`
+instead:
+
+- converts the render on the GPU (shaders/encode.comp) to the capture
+  format: 'rgba8' (values clamped to [0, 1]), 'srgb8' (the same after the
+  sRGB transfer curve, for linear renders) or 'half' (rgba16f, saved as
+  .npy)
+- packs the converted texture into one of a ring of pixel buffer objects;
+  the copy runs asynchronously and `capture` returns at once
+- collects a buffer `lag` frames later (`poll`, once per frame) with
+  `Buffer.read_into`, straight into a pooled NumPy array, by which time
+  the transfer has finished and nothing waits
+- hands the array to background encoder threads that write PNG (or .npy)
+
+`read` is the synchronous variant for one-off renders.
+
+Usage:
+    capture = FrameCapture(ctx, (W, H), 'rgba8', flip=True)
+    ...per frame, after the compute dispatch:
+    capture.capture(tex, 'frames/frame_0001.png')
+    capture.poll()
+    ...on exit:
+    capture.close()
+"""
+import collections
+import os
+import queue
+import threading
+import numpy as np
+from PIL import Image
+
+DIR = os.path.dirname(__file__)
+ENCODE_SHADER = os.path.join(DIR, 'shaders', 'encode.comp')
+# name: (image format of the converted texture, moderngl dtype, numpy dtype)
+FORMATS = {
+    'rgba8': ('rgba8', 'f1', np.uint8),
+    'srgb8': ('rgba8', 'f1', np.uint8),
+    'half': ('rgba16f', 'f2', np.float16),
+}
+
+
+def save_array(arr, path, fmt='rgba8'):
+    """Write an (H, W, 4) capture: RGB PNG for the 8-bit formats, float16 .npy for 'half'.
+
+    Returns the path written, which for 'half' has the extension replaced by .npy.
+    """
+    if FORMATS[fmt][2] == np.float16:
+        path = os.path.splitext(path)[0] + '.npy'
+        np.save(path, arr[..., :3])
+    else:
+        Image.fromarray(arr[..., :3], 'RGB').save(path)
+    return path
+
+
+class FrameCapture:
+    """Converts, reads back and encodes frames of one rgba32f texture size without stalling the caller."""
+
+    def __init__(self, ctx, size, fmt='rgba8', flip=False, buffers=3, lag=2, encoders=2, depth=8):
+        import moderngl
+        self.ctx = ctx
+        self.size = tuple(size)
+        self.fmt = fmt
+        self.flip = flip
+        self.lag = min(lag, buffers - 1)
+        image_format, dtype, self.dtype = FORMATS[fmt]
+        with open(ENCODE_SHADER, 'r', encoding='utf-8') as f:
+            self.encode = ctx.compute_shader(f.read().replace('DST_FORMAT', image_format))
+        self.target = ctx.texture(self.size, 4, dtype=dtype)
+        W, H = self.size
+        self.shape = (H, W, 4)
+        nbytes = W * H * 4 * np.dtype(self.dtype).itemsize
+        self.buffers = [ctx.buffer(reserve=nbytes, dynamic=True) for _ in range(buffers)]
+        self.barrier = moderngl.TEXTURE_UPDATE_BARRIER_BIT | moderngl.PIXEL_BUFFER_BARRIER_BIT
+        self.frame = 0
+        self.next_buffer = 0
+        self.pending = collections.deque()  # (frame issued, buffer, path)
+        self.pool = queue.SimpleQueue()  # arrays handed back by the encoders
+        self.queue = queue.Queue(maxsize=depth)
+        self.errors = []
+        self.written = []
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(encoders)]
+        for t in self.threads:
+            t.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            arr, path = item
+            try:
+                self.written.append(save_array(arr, path, self.fmt))
+            except Exception as exc:  # reported by close(); the render loop keeps going
+                self.errors.append((path, exc))
+            self.pool.put(arr)
+
+    def _array(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return np.empty(self.shape, dtype=self.dtype)
+
+    def _convert(self, tex):
+        tex.bind_to_image(0, read=True, write=False)
+        self.target.bind_to_image(1, read=False, write=True)
+        self.encode['u_srgb'] = self.fmt == 'srgb8'
+        self.encode['u_flip'] = self.flip
+        W, H = self.size
+        self.encode.run(group_x=(W + 7)//8, group_y=(H + 7)//8, group_z=1)
+        self.ctx.memory_barrier(self.barrier)
+
+    def read(self, tex):
+        """Synchronous capture of `tex`; returns an (H, W, 4) array in the capture format."""
+        self._convert(tex)
+        arr = np.empty(self.shape, dtype=self.dtype)
+        self.target.read_into(arr)
+        return arr
+
+    def capture(self, tex, path):
+        """Start reading back `tex`; it is written to `path` once collected by a later `poll`."""
+        if len(self.pending) == len(self.buffers):
+            self._collect()  # every buffer in flight: take the oldest now
+        self._convert(tex)
+        buf = self.buffers[self.next_buffer]
+        self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+        # with a buffer as the target the pack is queued on the GPU and returns immediately
+        self.target.read_into(buf)
+        self.pending.append((self.frame, buf, path))
+
+    def _collect(self):
+        _, buf, path = self.pending.popleft()
+        arr = self._array()
+        buf.read_into(arr)
+        self.queue.put((arr, path))
+
+    def poll(self):
+        """Call once per frame: hands every capture issued `lag` or more frames ago to the encoders."""
+        self.frame += 1
+        while self.pending and self.frame - self.pending[0][0] >= self.lag:
+            self._collect()
+
+    def close(self):
+        """Collect and encode everything outstanding; returns the written paths."""
+        while self.pending:
+            self._collect()
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.target.release()
+        for buf in self.buffers:
+            buf.release()
+        self.encode.release()
+        if self.errors:
+            raise RuntimeError(f'failed to write {len(self.errors)} capture(s): {self.errors[0]}')
+        return self.written
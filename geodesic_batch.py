@@ -0,0 +1,324 @@
+"""Vectorized NumPy engine for the equatorial null-geodesic renderers.
+
+Every ray of a render is held in flat arrays (r, phi, h, status) and advanced
+together.  Each ray keeps its own adaptive step and accept/reject decision;
+finished rays are compacted out of the active set so later iterations only
+touch rays that are still marching.  The output is a (H, W, 3) uint8 buffer
+instead of per-pixel Pillow writes.
+
+The default scheme mirrors `integrate_pixel_adaptive` in
+`geodesic_rk4_adaptive.py` (RK4 with step-doubling error control); embedded
+Dormand-Prince / Cash-Karp pairs are selected with `method=` (see
+`geodesic_integrators.py`).  The fixed-step mode mirrors the loop in
+`geodesic_rk4.py`.
+"""
+import math
+import numpy as np
+from PIL import Image
+
+import geodesic_integrators
+
+# per-ray termination status
+ACTIVE = 0
+CAPTURED = 1
+ESCAPED = 2
+TURNING = 3      # dr/dphi reached zero (periastron); phi is the half-deflection
+EXHAUSTED = 4    # max_steps hit without any other termination
+
+
+def dr_dphi(r, L, r_s=1.0, E=1.0):
+    """Array version of the scalar `dr_dphi`; returns 0 where the radicand is <= 0."""
+    with np.errstate(all='ignore'):
+        inside = E*E - (1.0 - r_s / r) * (L*L) / (r*r)
+        return np.where(inside > 0.0, (r*r / L) * np.sqrt(np.maximum(inside, 0.0)), 0.0)
+
+
+def rk4_step(r, h, L, r_s=1.0, E=1.0, k1=None):
+    """One RK4 step of size h (array) for r(phi); k1 may be passed in to reuse dr_dphi(r)."""
+    if k1 is None:
+        k1 = dr_dphi(r, L, r_s, E)
+    k2 = dr_dphi(r + 0.5*h*k1, L, r_s, E)
+    k3 = dr_dphi(r + 0.5*h*k2, L, r_s, E)
+    k4 = dr_dphi(r + h*k3, L, r_s, E)
+    return r + (h/6.0)*(k1 + 2*k2 + 2*k3 + k4)
+
+
+def integrate_batch(b, r_obs, r_s=1.0, E=1.0, tol=1e-3, rtol=0.0, h_init=0.02, h_min=1e-5,
+                    h_max=0.1, grow=1.5, max_steps=200000, phi_escape=0.05,
+                    adaptive=True, method='rk4', stats=None, ray_stats=None):
+    """Integrate every impact parameter in `b` inward from r_obs.
+
+    Returns (phi, status) arrays shaped like `b`.  With adaptive=False the
+    step is fixed at h_init (the `geodesic_rk4.py` scheme) and method must
+    be 'rk4'; otherwise `method` picks a stepper from `geodesic_integrators`
+    and a step is accepted when |error| <= tol + rtol*|r|.  If `stats` is a dict, the
+    totals 'rays', 'nfev', 'accepted' and 'rejected' are added to it.  If
+    `ray_stats` is a dict, it receives per-ray arrays shaped like `b`:
+    'steps' (attempted steps), 'rejected' and 'h_min' (smallest step tried,
+    NaN for rays that never stepped); the termination reason is `status`.
+    """
+    if method not in geodesic_integrators.METHODS:
+        raise ValueError(f'unknown method {method!r}, expected one of {geodesic_integrators.METHODS}')
+    if not adaptive and method != 'rk4':
+        raise ValueError(f'method {method!r} needs adaptive=True; the fixed-step mode is plain RK4')
+    if method == 'binet' and adaptive:
+        return integrate_binet(b, r_obs, r_s=r_s, E=E, tol=tol, rtol=rtol, h_init=h_init,
+                               h_min=h_min, h_max=h_max, max_steps=max_steps, stats=stats,
+                               ray_stats=ray_stats)
+    tab = geodesic_integrators.TABLEAUS.get(method)
+    b = np.asarray(b, dtype=np.float64)
+    shape = b.shape
+    b = b.ravel()
+    n = b.size
+    phi_out = np.zeros(n)
+    status_out = np.full(n, EXHAUSTED, dtype=np.int8)
+    nfev = accepted_total = rejected_total = 0
+
+    idx = np.arange(n)
+    L = np.maximum(np.abs(b), 1e-8)
+    r = np.full(n, float(r_obs))
+    phi = np.zeros(n)
+    h = np.full(n, float(h_init))
+    steps = np.zeros(n, dtype=np.int64)
+    # dr/dphi at the current r; NaN when it has to be re-evaluated
+    k1 = np.full(n, np.nan)
+    err_prev = np.ones(n)
+    # embedded pairs finish the inbound leg in closed form from within one step of periastron
+    r_p = geodesic_integrators.periastron(L, r_s, E) if adaptive and tab is not None else None
+    record = ray_stats is not None
+    if record:
+        rejected, h_least = np.zeros(n, dtype=np.int64), np.full(n, np.inf)
+        steps_out, rejected_out = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+        h_least_out = np.full(n, np.nan)
+
+    while idx.size:
+        status = np.zeros(idx.size, dtype=np.int8)
+        status[r <= r_s] = CAPTURED
+        stale = np.isnan(k1) & (status == ACTIVE)
+        k1[stale] = dr_dphi(r[stale], L[stale], r_s, E)
+        nfev += int(stale.sum())
+        status[(status == ACTIVE) & (k1 == 0.0)] = TURNING
+        if r_p is not None:
+            # a step of h would bring the ray to periastron (r - r_p ~ h * k1 / 2 for a parabolic
+            # approach), where stages would see the square root clamp to zero; sweep the rest
+            near = (status == ACTIVE) & (r - r_p <= h * k1)
+            if near.any():
+                tail, evals = geodesic_integrators.turning_sweep(r[near], r_p[near], L[near], E)
+                phi[near] += tail
+                nfev += evals * int(near.sum())
+                status[near] = TURNING
+        live = status == ACTIVE
+        m = int(live.sum())
+
+        if adaptive:
+            hl, rl, kl, Ll = h[live], r[live], k1[live], L[live]
+            f = lambda x: dr_dphi(x, Ll, r_s, E)
+            if tab is None:
+                r_new, err, evals = geodesic_integrators.rk4_doubling_step(f, rl, -hl, kl)
+                k_new = None
+            else:
+                r_new, err, k_new, evals = geodesic_integrators.embedded_step(tab, f, rl, -hl, kl)
+            nfev += evals * m
+            err = err / geodesic_integrators.error_scale(rl, r_new, tol, rtol)
+            ok = err <= 1.0
+            # forced accept when the step is already at h_min
+            accept = ok | (hl <= h_min + 1e-14)
+            accepted_total += int(accept.sum())
+            rejected_total += int((~accept).sum())
+            if tab is None:
+                h_new = np.where(ok, np.minimum(hl*grow, h_max),
+                                 np.where(accept, hl, np.maximum(hl*0.5, h_min)))
+                k1[live] = np.where(accept, np.nan, kl)
+            else:
+                fac = geodesic_integrators.pi_step_factor(err, err_prev[live], tab.order, ok)
+                h_new = np.clip(hl*fac, h_min, h_max)
+                err_prev[live] = np.where(ok, np.maximum(err, 1e-4), err_prev[live])
+                k1[live] = np.where(accept, k_new if k_new is not None else np.nan, kl)
+            r[live] = np.where(accept, r_new, rl)
+            phi[live] += np.where(accept, hl, 0.0)
+            h[live] = h_new
+            if record:
+                rejected[live] += ~accept
+                h_least[live] = np.minimum(h_least[live], hl)
+        else:
+            if record:
+                h_least[live] = np.minimum(h_least[live], h[live])
+            r[live] = rk4_step(r[live], -h[live], L[live], r_s, E, k1=k1[live])
+            phi[live] += h[live]
+            k1[live] = np.nan
+            nfev += 3 * m
+            accepted_total += m
+
+        bad = live & (np.isnan(r) | (r <= 0.0))
+        status[bad] = CAPTURED
+        live &= ~bad
+        status[live & (r > r_obs * 0.995) & (phi > phi_escape)] = ESCAPED
+        steps[live] += 1
+        status[(status == ACTIVE) & (steps >= max_steps)] = EXHAUSTED
+
+        done = status != ACTIVE
+        if done.any():
+            phi_out[idx[done]] = phi[done]
+            status_out[idx[done]] = status[done]
+            keep = ~done
+            if record:
+                steps_out[idx[done]] = steps[done]
+                rejected_out[idx[done]] = rejected[done]
+                h_least_out[idx[done]] = h_least[done]
+                rejected, h_least = rejected[keep], h_least[keep]
+            idx, L, r, phi, h, steps = idx[keep], L[keep], r[keep], phi[keep], h[keep], steps[keep]
+            k1, err_prev = k1[keep], err_prev[keep]
+            if r_p is not None:
+                r_p = r_p[keep]
+
+    if stats is not None:
+        for key, value in (('rays', n), ('nfev', nfev), ('accepted', accepted_total),
+                           ('rejected', rejected_total)):
+            stats[key] = stats.get(key, 0) + value
+    if record:
+        _store_ray_stats(ray_stats, shape, steps_out, rejected_out, h_least_out)
+    return phi_out.reshape(shape), status_out.reshape(shape)
+
+
+def integrate_binet(b, r_obs, r_s=1.0, E=1.0, tol=1e-3, rtol=0.0, h_init=0.02, h_min=1e-5,
+                    h_max=0.1, max_steps=200000, stats=None, ray_stats=None, refine=2):
+    """Integrate the Binet form u'' = -u + 3/2 r_s u^2 inward from r_obs with Dormand-Prince.
+
+    There is no square root, so nothing stalls near the turning point.  When
+    an accepted step carries u' = du/dphi through zero, periastron is placed
+    by `refine` Newton iterations on v(theta*h), each a fresh step from the
+    start of the interval.  The ray then ends with status TURNING and phi the
+    inbound sweep; the outbound leg is its mirror image and is not integrated.
+    Tolerances keep the meaning of `integrate_batch` (tol in units of r).
+    Returns (phi, status) like `integrate_batch`, and fills `ray_stats` the same way.
+    """
+    tab = geodesic_integrators.DOPRI5
+    f = geodesic_integrators.binet_rhs(r_s)
+    b = np.asarray(b, dtype=np.float64)
+    shape = b.shape
+    b = b.ravel()
+    n = b.size
+    phi_out = np.zeros(n)
+    status_out = np.full(n, EXHAUSTED, dtype=np.int8)
+    nfev = accepted_total = rejected_total = 0
+
+    b_eff = np.maximum(np.abs(b), 1e-8) / E
+    u_obs = 1.0 / r_obs
+    g0 = 1.0 / (b_eff*b_eff) - u_obs*u_obs + r_s*u_obs**3
+    # g0 <= 0: the ray is tangent at (or cannot reach) r_obs, so it turns immediately
+    status_out[g0 <= 0.0] = TURNING
+    idx = np.nonzero(g0 > 0.0)[0]
+    y = np.stack([np.full(idx.size, u_obs), np.sqrt(g0[idx])])
+    phi = np.zeros(idx.size)
+    h = np.full(idx.size, float(h_init))
+    steps = np.zeros(idx.size, dtype=np.int64)
+    k1 = f(y)
+    nfev += idx.size
+    err_prev = np.ones(idx.size)
+    u_horizon = 1.0 / r_s
+    record = ray_stats is not None
+    if record:
+        rejected, h_least = np.zeros(idx.size, dtype=np.int64), np.full(idx.size, np.inf)
+        steps_out, rejected_out = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+        h_least_out = np.full(n, np.nan)
+
+    while idx.size:
+        y_new, err, k_new, evals = geodesic_integrators.embedded_step(tab, f, y, h, k1)
+        nfev += evals * idx.size
+        u_max = np.maximum(np.abs(y[0]), np.abs(y_new[0]))
+        # |dr| = |du|/u^2, so an r tolerance of tol is a u tolerance of tol*u^2
+        with np.errstate(invalid='ignore'):
+            scale = tol*u_max*u_max + rtol*u_max
+            err = np.max(err / scale, axis=0)
+        ok = err <= 1.0
+        accept = ok | (h <= h_min + 1e-14)
+        accepted_total += int(accept.sum())
+        rejected_total += int((~accept).sum())
+        if record:
+            rejected += ~accept
+            h_least = np.minimum(h_least, h)
+
+        fac = geodesic_integrators.pi_step_factor(err, err_prev, tab.order, ok)
+        err_prev = np.where(ok, np.maximum(err, 1e-4), err_prev)
+        status = np.zeros(idx.size, dtype=np.int8)
+
+        turned = accept & (y_new[1] <= 0.0)
+        if turned.any():
+            # Newton on v(theta*h) = 0, starting from the linear crossing
+            y0, k0, ht = y[:, turned], k1[:, turned], h[turned]
+            v0, v1 = y0[1], y_new[1, turned]
+            theta = np.clip(v0 / np.maximum(v0 - v1, 1e-300), 0.0, 1.0)
+            for _ in range(refine):
+                yt, _, kt, evals = geodesic_integrators.embedded_step(tab, f, y0, theta*ht, k0)
+                nfev += evals * theta.size
+                # kt = f(yt), so kt[1] = dv/dphi at the trial point
+                theta = np.clip(theta - yt[1] / np.where(kt[1] != 0.0, kt[1]*ht, -1e-300), 0.0, 1.0)
+            phi[turned] = phi[turned] + theta*ht
+            status[turned] = TURNING
+
+        go = accept & ~turned
+        y = np.where(go, y_new, y)
+        k1 = np.where(go, k_new, k1)
+        phi = np.where(go, phi + h, phi)
+        h = np.clip(h*fac, h_min, h_max)
+
+        status[(status == ACTIVE) & ((y[0] >= u_horizon) | np.isnan(y[0]))] = CAPTURED
+        steps += 1
+        status[(status == ACTIVE) & (steps >= max_steps)] = EXHAUSTED
+
+        done = status != ACTIVE
+        if done.any():
+            phi_out[idx[done]] = phi[done]
+            status_out[idx[done]] = status[done]
+            keep = ~done
+            if record:
+                steps_out[idx[done]] = steps[done]
+                rejected_out[idx[done]] = rejected[done]
+                h_least_out[idx[done]] = h_least[done]
+                rejected, h_least = rejected[keep], h_least[keep]
+            idx, y, k1, phi, h, steps, err_prev = (idx[keep], y[:, keep], k1[:, keep], phi[keep],
+                                                   h[keep], steps[keep], err_prev[keep])
+
+    if stats is not None:
+        for key, value in (('rays', n), ('nfev', nfev), ('accepted', accepted_total),
+                           ('rejected', rejected_total)):
+            stats[key] = stats.get(key, 0) + value
+    if record:
+        _store_ray_stats(ray_stats, shape, steps_out, rejected_out, h_least_out)
+    return phi_out.reshape(shape), status_out.reshape(shape)
+
+
+def _store_ray_stats(ray_stats, shape, steps, rejected, h_least):
+    ray_stats['steps'] = steps.reshape(shape)
+    ray_stats['rejected'] = rejected.reshape(shape)
+    ray_stats['h_min'] = h_least.reshape(shape)
+
+
+def sample_background(phi):
+    """Vectorized colour wheel; uint8 array of shape phi.shape + (3,)."""
+    t = np.mod(np.asarray(phi, dtype=np.float64) / (2*math.pi), 1.0)
+    rgb = np.stack([0.5 + 0.5*np.cos(2*math.pi*(t + off)) for off in (0.0, 0.33, 0.66)], axis=-1)
+    return (255*rgb).astype(np.uint8)
+
+
+def shade(phi, status):
+    """Colour rays by deflection angle; captured rays are black."""
+    img = sample_background(phi)
+    img[status == CAPTURED] = 0
+    return img
+
+
+def screen_impact_parameters(W, H, b_scale):
+    """Impact parameter b = x * b_scale for every pixel centre, shape (H, W)."""
+    x = (np.arange(W) + 0.5) / W * 2.0 - 1.0
+    return np.broadcast_to(x * b_scale, (H, W))
+
+
+def render(W, H, r_obs, b_scale, **params):
+    """Render the deflection image; returns a (H, W, 3) uint8 buffer."""
+    phi, status = integrate_batch(screen_impact_parameters(W, H, b_scale), r_obs, **params)
+    return shade(phi, status)
+
+
+def save_png(buf, path):
+    Image.fromarray(buf, 'RGB').save(path)
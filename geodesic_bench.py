@@ -0,0 +1,273 @@
+"""Benchmarks for the geodesic integrators: throughput, step statistics, memory and work-precision.
+
+Every case integrates the unique impact parameters of a pinhole image (the
+rays the camera renderers actually trace) with one script's PARAMS, an
+integration method and a tolerance, and reports
+
+- rays/s and pixels/s (best of --repeat runs)
+- derivative evaluations, accepted and rejected steps per ray
+- peak traced memory (tracemalloc, in a separate untimed run)
+- median / max |phi - phi_ref| over rays that turn, against the exact
+  elliptic-integral deflection, and the fraction of rays whose capture
+  status disagrees with it
+
+Results are written as JSON; --compare flags cases that got slower, more
+expensive or less accurate than a previous run and exits non-zero.  Every
+result records its repeat count, and timings are only compared when both
+runs kept the best of at least MIN_TIMING_REPEAT repeats (a --quick run
+times once, which is too noisy to flag).
+
+Usage:
+    python geodesic_bench.py --out bench.json
+    python geodesic_bench.py --quick --methods rk4 dopri5 binet --compare bench.json
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+import geodesic_batch
+import geodesic_camera
+import geodesic_elliptic
+import geodesic_integrators
+import geodesic_rk4
+import geodesic_rk4_adaptive
+import geodesic_rk4_medium
+import geodesic_rk4_quick
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = {
+    'rk4': geodesic_rk4,
+    'adaptive': geodesic_rk4_adaptive,
+    'medium': geodesic_rk4_medium,
+    'quick': geodesic_rk4_quick,
+}
+RESOLUTIONS = ((200, 100), (400, 200), (800, 400))
+TOLERANCES = (1e-2, 1e-3, 1e-4)
+
+# metric -> +1 if higher is better, -1 if lower is better
+METRICS = {'rays_per_s': 1, 'nfev_per_ray': -1, 'rejected_per_ray': -1, 'peak_mb': -1,
+           'err_median': -1, 'status_mismatch': -1}
+# errors below this are treated as equal when comparing accuracy
+ERR_FLOOR = 1e-9
+# wall-clock metrics, compared only between runs with at least MIN_TIMING_REPEAT repeats
+TIMING_METRICS = ('rays_per_s',)
+MIN_TIMING_REPEAT = 3
+
+
+def case_rays(W, H, b_scale):
+    """Unique impact parameters of a W x H pinhole image and its pixel count."""
+    b, _ = geodesic_camera.pinhole_rays(*geodesic_camera.pixel_centres(W, H), W, H, b_scale)
+    return np.unique(b), W * H
+
+
+def accuracy(phi, status, phi_ref, status_ref):
+    """Work-precision numbers against the elliptic reference."""
+    captured = status == geodesic_batch.CAPTURED
+    mismatch = float(np.mean(captured != (status_ref == geodesic_batch.CAPTURED)))
+    both = (status == geodesic_batch.TURNING) & (status_ref == geodesic_batch.TURNING)
+    if not both.any():
+        return {'err_median': None, 'err_max': None, 'status_mismatch': mismatch}
+    err = np.abs(phi[both] - phi_ref[both])
+    return {'err_median': float(np.median(err)), 'err_max': float(err.max()), 'status_mismatch': mismatch}
+
+
+def run_case(script, method, W, H, tol=None, repeat=3, memory=True):
+    """Benchmark one (script, method, resolution, tolerance) combination; returns a result dict."""
+    mod = SCRIPTS[script]
+    params = dict(mod.PARAMS, method=method)
+    if tol is not None:
+        params['tol'] = tol
+    b, pixels = case_rays(W, H, mod.b_scale)
+    integrate = (geodesic_elliptic.deflect if method == 'elliptic' else geodesic_batch.integrate_batch)
+
+    best = math.inf
+    stats = {}
+    for _ in range(repeat):
+        run_stats = {}
+        kwargs = params if method == 'elliptic' else dict(params, stats=run_stats)
+        t0 = time.perf_counter()
+        phi, status = integrate(b, mod.r_obs, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+        stats = run_stats
+
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        integrate(b, mod.r_obs, **params)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    phi_ref, status_ref = geodesic_elliptic.deflect(b, mod.r_obs, params['r_s'], params['E'])
+    n = b.size
+    result = {
+        'case': case_id(script, method, W, H, tol),
+        'script': script, 'method': method, 'width': W, 'height': H, 'tol': tol,
+        'rays': n, 'pixels': pixels, 'repeat': repeat, 'seconds': best,
+        'rays_per_s': n / best, 'pixels_per_s': pixels / best,
+        'nfev_per_ray': stats.get('nfev', 0) / n,
+        'accepted_per_ray': stats.get('accepted', 0) / n,
+        'rejected_per_ray': stats.get('rejected', 0) / n,
+        'exhausted': int(np.sum(status == geodesic_batch.EXHAUSTED)),
+        'peak_mb': peak_mb,
+    }
+    result.update(accuracy(phi, status, phi_ref, status_ref))
+    return result
+
+
+def case_id(script, method, W, H, tol):
+    return f'{script}/{method}/{W}x{H}/tol={tol:g}' if tol is not None else f'{script}/{method}/{W}x{H}'
+
+
+def run_gl(W, H, repeat=3):
+    """Time shaders/geodesic_rk4.comp if a GL 4.3 context can be created; None otherwise."""
+    try:
+        import run_compute_geodesic
+        renderer = run_compute_geodesic.ComputeRenderer()
+    except Exception as exc:  # no moderngl, no driver, or no compute support
+        print(f'  skipping GL benchmark: {exc}')
+        return None
+    mod = geodesic_rk4
+    best = math.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        renderer.render(W, H, r_s=mod.r_s, r_obs=mod.r_obs, b_scale=mod.b_scale)
+        best = min(best, time.perf_counter() - t0)
+    renderer.release()
+    return {'case': f'gl/rk4/{W}x{H}', 'script': 'gl', 'method': 'rk4', 'width': W, 'height': H,
+            'tol': None, 'rays': W * H, 'pixels': W * H, 'repeat': repeat, 'seconds': best,
+            'rays_per_s': W * H / best, 'pixels_per_s': W * H / best}
+
+
+def run_matrix(scripts, methods, resolutions, tolerances, repeat=3, memory=True, gl=True):
+    results = []
+    for W, H in resolutions:
+        for script in scripts:
+            adaptive = SCRIPTS[script].PARAMS.get('adaptive', True)
+            for method in methods:
+                if not adaptive and method not in ('rk4', 'elliptic'):
+                    continue  # fixed-step RK4 ignores the stepper choice
+                # the fixed-step script and the exact backend have no tolerance to sweep
+                tols = tolerances if adaptive and method != 'elliptic' else (None,)
+                for tol in tols:
+                    res = run_case(script, method, W, H, tol, repeat, memory)
+                    results.append(res)
+                    print(format_result(res))
+        if gl:
+            res = run_gl(W, H, repeat)
+            if res is not None:
+                results.append(res)
+                print(format_result(res))
+    return results
+
+
+def format_result(res):
+    err = res.get('err_median')
+    peak = res.get('peak_mb')
+    return (f"{res['case']:<34} {res['rays_per_s']:>11.0f} rays/s  "
+            f"{res.get('nfev_per_ray', 0):>7.1f} nfev/ray  {res.get('rejected_per_ray', 0):>6.1f} rej/ray  "
+            f"err {err if err is not None else float('nan'):.1e}  "
+            f"{peak if peak is not None else float('nan'):>6.1f} MB")
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'processor': platform.processor()}
+
+
+def compare(results, baseline, threshold=0.1, untimed=None):
+    """Regressions of `results` against a previous run: list of (case, metric, old, new).
+
+    Timing metrics are skipped for a case when either run has fewer than
+    MIN_TIMING_REPEAT repeats; such cases are appended to `untimed`.
+    Results written before repeats were recorded count as fully timed.
+    """
+    old = {r['case']: r for r in baseline['results']}
+    regressions = []
+    for res in results:
+        ref = old.get(res['case'])
+        if ref is None:
+            continue
+        timed = min(res.get('repeat', MIN_TIMING_REPEAT), ref.get('repeat', MIN_TIMING_REPEAT)) >= MIN_TIMING_REPEAT
+        if not timed and untimed is not None:
+            untimed.append(res['case'])
+        for metric, sign in METRICS.items():
+            a, b = ref.get(metric), res.get(metric)
+            if a is None or b is None or (metric in TIMING_METRICS and not timed):
+                continue
+            if metric.startswith('err'):
+                a, b = max(a, ERR_FLOOR), max(b, ERR_FLOOR)
+            if metric == 'status_mismatch':
+                worse = b > a
+            elif sign > 0:
+                worse = b < a * (1.0 - threshold)
+            else:
+                worse = b > a * (1.0 + threshold) and b - a > 1e-12
+            if worse:
+                regressions.append((res['case'], metric, a, b))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Geodesic integrator benchmarks')
+    parser.add_argument('--scripts', nargs='+', choices=sorted(SCRIPTS), default=sorted(SCRIPTS))
+    parser.add_argument('--methods', nargs='+', choices=geodesic_integrators.METHODS + ('elliptic',),
+                        default=['rk4'])
+    parser.add_argument('--resolutions', nargs='+', default=None, metavar='WxH',
+                        help='default: ' + ' '.join(f'{w}x{h}' for w, h in RESOLUTIONS))
+    parser.add_argument('--tols', nargs='+', type=float, default=list(TOLERANCES))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case (best is kept)')
+    parser.add_argument('--quick', action='store_true', help='200x100 only, one tolerance, one run')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--no-gl', action='store_true', help='skip the compute-shader benchmark')
+    parser.add_argument('--out', default='geodesic_bench.json', help='JSON results file')
+    parser.add_argument('--compare', default=None, help='previous results JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change that counts as a regression (default 10%%)')
+    args = parser.parse_args(argv)
+
+    if args.resolutions:
+        resolutions = [tuple(int(v) for v in r.lower().split('x')) for r in args.resolutions]
+    else:
+        resolutions = RESOLUTIONS
+    tols, repeat = args.tols, args.repeat
+    if args.quick:
+        resolutions, tols, repeat = [(200, 100)], [1e-3], 1
+
+    results = run_matrix(args.scripts, args.methods, resolutions, tols, repeat,
+                         memory=not args.no_memory, gl=not args.no_gl)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump({'meta': dict(metadata(), repeat=repeat), 'results': results}, f, indent=1)
+    print(f'Saved {args.out}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        untimed = []
+        regressions = compare(results, baseline, args.threshold, untimed)
+        if untimed:
+            print(f'Note: timings not compared for {len(untimed)} case(s) timed fewer than {MIN_TIMING_REPEAT} '
+                  f'times (use --repeat {MIN_TIMING_REPEAT} without --quick on both runs)')
+        for case, metric, a, b in regressions:
+            print(f'REGRESSION {case}: {metric} {a:.4g} -> {b:.4g}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions against {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
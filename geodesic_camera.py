@@ -0,0 +1,191 @@
+"""2D observer cameras for the Schwarzschild renderers.
+
+The metric is spherically symmetric, so every camera ray lies in a plane
+through the black hole and the observer.  A pixel is described by its impact
+parameter b (the radial distance from the image centre) and the azimuth psi
+of its ray plane around the optical axis.  The ray is integrated in the
+equatorial plane, where only b matters, and its final direction is rotated
+back by psi onto the sky.  Pixels with the same radius share one
+integration, so a full image costs O(unique radii) instead of O(pixels).
+
+Cameras:
+- profile  : the 1D deflection profile of the original renderers, b = x * b_scale,
+             coloured by phi with `geodesic_batch.sample_background`
+- pinhole  : image-plane camera, b = rho * b_scale with rho the distance from
+             the centre in units of the half-width (same scale as the 1D renderers)
+- equirect : full-sky panorama of view directions around the observer
+
+Everything works on arrays of pixel coordinates (px, py), with pixel i
+covering [i, i+1); `render` is the full-image case with px = i + 0.5.
+"""
+import math
+import numpy as np
+
+import geodesic_batch
+import geodesic_elliptic
+import geodesic_lut
+
+CAMERAS = ('pinhole', 'equirect')
+ENGINES = ('batch', 'lut', 'elliptic')
+
+
+def pixel_centres(W, H, x0=0, y0=0, x1=None, y1=None):
+    """(px, py) grids of pixel centres for the window [x0, x1) x [y0, y1)."""
+    x1 = W if x1 is None else x1
+    y1 = H if y1 is None else y1
+    return np.meshgrid(np.arange(x0, x1) + 0.5, np.arange(y0, y1) + 0.5)
+
+
+def _offsets(px, py, W, H):
+    # half-pixel units relative to the centre; exact for pixel centres, so symmetric pixels match bit for bit
+    return 2.0*np.asarray(px, dtype=np.float64) - W, H - 2.0*np.asarray(py, dtype=np.float64)
+
+
+def profile_rays(px, py, W, H, b_scale):
+    dx, _ = _offsets(px, py, W, H)
+    b = dx / W * b_scale
+    return np.abs(b), np.where(b < 0.0, math.pi, 0.0)
+
+
+def pinhole_rays(px, py, W, H, b_scale):
+    """Return (b, psi) per pixel."""
+    dx, dy = _offsets(px, py, W, H)
+    b = np.sqrt(dx*dx + dy*dy) / W * b_scale
+    return b, np.arctan2(dy, dx)
+
+
+def equirect_rays(px, py, W, H, r_obs, r_s=1.0):
+    """Return (b, psi, inward) for a full-sky panorama centred on the black hole.
+
+    The view angle alpha from the direction to the hole gives the impact
+    parameter of a static observer, b = r_obs * sin(alpha) / sqrt(1 - r_s/r_obs).
+    """
+    dx, dy = _offsets(px, py, W, H)
+    lon = dx / W * math.pi
+    lat = dy / H * (0.5*math.pi)
+    vx = np.cos(lat) * np.sin(lon)
+    vy = np.sin(lat)
+    cos_alpha = np.clip(np.cos(lat) * np.cos(lon), -1.0, 1.0)
+    sin_alpha = np.sqrt(1.0 - cos_alpha**2)
+    b = r_obs * sin_alpha / math.sqrt(1.0 - r_s / r_obs)
+    return b, np.arctan2(vy, vx), cos_alpha > 0.0
+
+
+def camera_rays(px, py, W, H, r_obs, b_scale, camera='pinhole', r_s=1.0):
+    """(b, psi, inward) for any camera; inward is False for rays pointing away from the hole."""
+    if camera == 'profile':
+        b, psi = profile_rays(px, py, W, H, b_scale)
+    elif camera == 'pinhole':
+        b, psi = pinhole_rays(px, py, W, H, b_scale)
+    elif camera == 'equirect':
+        return equirect_rays(px, py, W, H, r_obs, r_s)
+    else:
+        raise ValueError(f'unknown camera {camera!r}, expected profile or one of {CAMERAS}')
+    return b, psi, np.ones(b.shape, dtype=bool)
+
+
+def total_sweep(phi, status, b, r_obs):
+    """Angle swept from the observer to infinity in the ray plane.
+
+    The engine stops at periastron (or, for near-tangent rays, as soon as
+    the escape test fires), so such a ray sweeps its inbound angle twice
+    plus the leg from r_obs to infinity (flat-space asin(b/r_obs)).
+    """
+    tail = np.arcsin(np.clip(b / r_obs, 0.0, 1.0))
+    turned = (status == geodesic_batch.TURNING) | (status == geodesic_batch.ESCAPED)
+    return np.where(turned, 2.0*phi + tail, phi)
+
+
+def sky_direction(sweep, psi):
+    """Rotate the in-plane final position angle back onto the sky; returns (lon, lat).
+
+    The observer sits on +z looking at the hole along -z; an undeflected
+    central ray (sweep = pi) lands at lon = lat = 0.
+    """
+    sin_s = np.sin(sweep)
+    nx = sin_s * np.cos(psi)
+    ny = sin_s * np.sin(psi)
+    nz = np.cos(sweep)
+    return np.arctan2(nx, -nz), np.arcsin(np.clip(ny, -1.0, 1.0))
+
+
+def sample_sky(lon, lat, grid_deg=15.0):
+    """Procedural sky: the renderer colour wheel in longitude with a darkened lon/lat grid."""
+    col = geodesic_batch.sample_background(lon).astype(np.float32)
+    step = math.radians(grid_deg)
+    width = 0.06
+    on_grid = ((np.abs(np.mod(lon / step + 0.5, 1.0) - 0.5) < width)
+               | (np.abs(np.mod(lat / step + 0.5, 1.0) - 0.5) < width))
+    col[on_grid] *= 0.35
+    return col.astype(np.uint8)
+
+
+def integrate_unique(b, r_obs, engine='batch', cache_dir=geodesic_lut.CACHE_DIR, **params):
+    """Integrate each distinct impact parameter once and scatter (phi, status) back to b's shape.
+
+    A `ray_stats` dict is only filled by the batch engine (see `geodesic_batch.integrate_batch`).
+    """
+    ray_stats = params.pop('ray_stats', None)
+    if b.size == 0:
+        return np.zeros(b.shape), np.zeros(b.shape, dtype=np.int8)
+    ub, inverse = np.unique(b, return_inverse=True)
+    if engine == 'lut':
+        lut = geodesic_lut.get_lut(float(ub[-1]), r_obs, cache_dir=cache_dir, **params)
+        phi, status = lut.lookup(ub)
+    elif engine == 'elliptic':
+        phi, status = geodesic_elliptic.deflect(ub, r_obs, **params)
+    elif engine == 'batch':
+        phi, status = geodesic_batch.integrate_batch(ub, r_obs, ray_stats=ray_stats, **params)
+    else:
+        raise ValueError(f'unknown engine {engine!r}, expected one of {ENGINES}')
+    inverse = inverse.reshape(b.shape)
+    if ray_stats:
+        for key, value in ray_stats.items():
+            ray_stats[key] = value[inverse]
+    return phi[inverse], status[inverse]
+
+
+def trace(px, py, W, H, r_obs, b_scale, camera='pinhole', engine='batch',
+          cache_dir=geodesic_lut.CACHE_DIR, **params):
+    """Integrate the rays through pixel coordinates (px, py); returns (phi, status, b, psi, inward).
+
+    A `ray_stats` dict in params receives per-pixel step counters; outward rays are never stepped.
+    """
+    b, psi, inward = camera_rays(px, py, W, H, r_obs, b_scale, camera, params.get('r_s', 1.0))
+    phi = np.zeros(b.shape)
+    status = np.full(b.shape, geodesic_batch.ESCAPED, dtype=np.int8)
+    phi[inward], status[inward] = integrate_unique(b[inward], r_obs, engine=engine,
+                                                   cache_dir=cache_dir, **params)
+    ray_stats = params.get('ray_stats')
+    if ray_stats:
+        for key, value in ray_stats.items():
+            full = np.full(b.shape, np.nan if value.dtype.kind == 'f' else 0, dtype=value.dtype)
+            full[inward] = value
+            ray_stats[key] = full
+    return phi, status, b, psi, inward
+
+
+def shade(phi, status, b, psi, inward, r_obs, camera='pinhole', sky=sample_sky):
+    """Colour traced rays; uint8 array of shape phi.shape + (3,)."""
+    if camera == 'profile':
+        return geodesic_batch.shade(phi, status)
+    sweep = total_sweep(phi, status, b, r_obs)
+    # rays pointing away from the hole leave almost unbent, at pi - alpha from +z
+    sweep = np.where(inward, sweep, np.arcsin(np.clip(b / r_obs, 0.0, 1.0)))
+    img = sky(*sky_direction(sweep, psi))
+    img[status == geodesic_batch.CAPTURED] = 0
+    return img
+
+
+def render_pixels(px, py, W, H, r_obs, b_scale, camera='pinhole', engine='batch', sky=sample_sky,
+                  cache_dir=geodesic_lut.CACHE_DIR, **params):
+    """Colours for arbitrary pixel coordinates of a W x H image."""
+    traced = trace(px, py, W, H, r_obs, b_scale, camera, engine, cache_dir, **params)
+    return shade(*traced, r_obs, camera, sky)
+
+
+def render(W, H, r_obs, b_scale, camera='pinhole', engine='batch', sky=sample_sky,
+           cache_dir=geodesic_lut.CACHE_DIR, **params):
+    """Render a full image; returns a (H, W, 3) uint8 buffer."""
+    px, py = pixel_centres(W, H)
+    return render_pixels(px, py, W, H, r_obs, b_scale, camera, engine, sky, cache_dir, **params)
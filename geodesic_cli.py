@@ -0,0 +1,176 @@
+"""Command-line options shared by the geodesic_rk4*.py renderers.
+
+Each script keeps its own constants (W, H, r_obs, b_scale, PARAMS) and a
+scalar reference loop; this module adds the common size/engine/camera
+switches and dispatches the render.
+"""
+import math
+import numpy as np
+
+import geodesic_camera
+import geodesic_cluster
+import geodesic_instrument
+import geodesic_integrators
+import geodesic_progressive
+import geodesic_store
+import geodesic_supersample
+import geodesic_tiles
+import sky_background
+
+
+def add_render_args(parser):
+    parser.add_argument('--width', type=int, default=None, help="output width (default: the script's W)")
+    parser.add_argument('--height', type=int, default=None, help="output height (default: the script's H)")
+    parser.add_argument('--engine', choices=['batch', 'lut', 'elliptic', 'scalar'], default='batch',
+                        help='batch: vectorized NumPy integrator (default); lut: cached phi(b) table; '
+                             'elliptic: closed-form Carlson R_F deflection; scalar: per-pixel reference loop')
+    parser.add_argument('--camera', choices=('none',) + geodesic_camera.CAMERAS, default='none',
+                        help='none: 1D deflection profile b = x * b_scale (default); '
+                             'pinhole/equirect: 2D sky camera using the radial symmetry of the metric')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='render tiles on N processes into a shared-memory framebuffer')
+    parser.add_argument('--tile', type=int, default=64, help='tile edge in pixels for --workers')
+    parser.add_argument('--coordinator', metavar='[HOST:]PORT', default=None,
+                        help='serve tiles to `geodesic_cluster.py worker` processes on other hosts')
+    parser.add_argument('--local-workers', type=int, default=0,
+                        help='with --coordinator, also start N workers on this machine')
+    parser.add_argument('--lease', type=float, default=30.0,
+                        help='seconds without a heartbeat before a worker\'s tile is requeued')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='with --coordinator, times a tile may be requeued before the render fails')
+    parser.add_argument('--instrument', metavar='PREFIX', default=None,
+                        help='record per-ray steps, rejections, min h and termination reason plus per-row '
+                             'wall time; writes PREFIX.npz, PREFIX.json and PREFIX_steps/_time.png heatmaps')
+    parser.add_argument('--instrument-by', choices=['row', 'tile'], default='row',
+                        help='time rows (default) or --tile sized tiles with --instrument')
+    parser.add_argument('--progressive', action='store_true',
+                        help='render coarse-to-fine (--strides), refining only where neighbouring samples disagree, '
+                             'and rewrite --preview after every pass')
+    parser.add_argument('--strides', type=int, nargs='+', default=list(geodesic_progressive.STRIDES),
+                        help='sample spacing of the progressive passes (default 4 2 1: 1/16, 1/4, full)')
+    parser.add_argument('--refine-threshold', type=float, default=8,
+                        help='colour spread (0-255) above which a progressive cell is traced rather than '
+                             'interpolated; 0 traces every pixel')
+    parser.add_argument('--preview', default='geodesic_preview.png', help='preview image for --progressive')
+    parser.add_argument('--aa', type=int, default=1, metavar='N',
+                        help='N x N stratified subsamples on pixels next to a capture or phi edge (default 1: off)')
+    parser.add_argument('--aa-threshold', type=float, default=0.1,
+                        help='phi jump in radians between neighbours that marks an edge pixel for --aa')
+    parser.add_argument('--method', choices=geodesic_integrators.METHODS, default='rk4',
+                        help='adaptive stepper: rk4 step doubling (default), dopri5 or cashkarp embedded pairs, '
+                             'binet (u = 1/r form with periastron location)')
+    parser.add_argument('--rtol', type=float, default=None,
+                        help='relative tolerance added to the absolute tol: |err| <= tol + rtol*|r|')
+    parser.add_argument('--sky', metavar='IMAGE', default=None,
+                        help='equirectangular sky image for --camera pinhole/equirect instead of the colour wheel; '
+                             'converted once to memory-mapped mip levels in sky_cache/')
+    parser.add_argument('--sky-level', type=int, default=None,
+                        help='sky mip level (default: matched to the undeflected pixel size)')
+    parser.add_argument('--store', metavar='DIR', default=None,
+                        help='write float32 phi, status, steps and colour tile by tile to memory-mapped .npy files '
+                             'in DIR (resumable, see geodesic_store.py); the PNG is a downsampled preview')
+    parser.add_argument('--preview-size', type=int, default=2048, help='longest side of the --store preview PNG')
+    return parser
+
+
+def frame_size(args, W, H):
+    """(W, H) with --width/--height applied."""
+    return args.width or W, args.height or H
+
+
+def engine_params(args, params):
+    """The script's PARAMS with the command-line stepper settings applied."""
+    params = dict(params, method=args.method)
+    if args.rtol is not None:
+        params['rtol'] = args.rtol
+    return params
+
+
+def sky_pixel_angle(camera, W, r_obs, b_scale):
+    """Sky angle covered by one pixel without lensing, which picks the sky mip level."""
+    if camera == 'equirect':
+        return 2 * math.pi / W
+    # pinhole: b = rho * b_scale with rho in half-widths, and b ~ r_obs * alpha for small view angles
+    return 2 * b_scale / (W * r_obs)
+
+
+def sky_map(args, W, r_obs, b_scale):
+    """The --sky SkyMap at --sky-level (or the level matching the pixel size)."""
+    sky = sky_background.SkyMap.open(args.sky)
+    if args.sky_level is not None:
+        sky.level = min(args.sky_level, len(sky.levels) - 1)
+    else:
+        sky.level = sky.level_for(sky_pixel_angle(args.camera, W, r_obs, b_scale))
+    print(f'  sky {sky.size[0]}x{sky.size[1]}, level {sky.level}')
+    return sky
+
+
+def render(args, W, H, r_obs, b_scale, params, render_scalar=None):
+    """Render with the engine/camera selected on the command line; returns a (H, W, 3) uint8 buffer."""
+    params = engine_params(args, params)
+    if not params.get('adaptive', True) and args.method != 'rk4' and args.engine in ('batch', 'lut'):
+        raise SystemExit(f'--method {args.method} needs an adaptive renderer; this script steps with fixed-step RK4')
+    if args.sky:
+        if args.engine == 'scalar' or args.camera == 'none':
+            raise SystemExit('--sky needs --camera pinhole or equirect and --engine batch, lut or elliptic')
+        if args.instrument or args.progressive or args.aa > 1 or args.coordinator:
+            raise SystemExit('--sky works with the plain and --workers renders; drop '
+                             '--instrument/--progressive/--aa/--coordinator')
+        params['sky'] = sky_map(args, W, r_obs, b_scale)
+    if args.store:
+        if args.engine == 'scalar':
+            raise SystemExit('--store needs --engine batch, lut or elliptic')
+        if args.instrument or args.progressive or args.aa > 1 or args.coordinator:
+            raise SystemExit('--store works with the plain and --workers renders; drop '
+                             '--instrument/--progressive/--aa/--coordinator')
+        camera = 'profile' if args.camera == 'none' else args.camera
+        geodesic_store.render_to_store(W, H, r_obs, b_scale, args.store, camera=camera, engine=args.engine,
+                                       workers=args.workers, tile=args.tile, **params)
+        print(f'  saved {args.store}/ (phi, status, steps, colour)')
+        return geodesic_store.preview(args.store, args.preview_size)
+    if args.engine == 'scalar':
+        if args.camera != 'none' or args.workers > 1 or args.coordinator:
+            raise SystemExit('--camera, --workers and --coordinator need --engine batch, lut or elliptic')
+        return np.asarray(render_scalar(), dtype=np.uint8)
+    camera = 'profile' if args.camera == 'none' else args.camera
+    if args.instrument:
+        if args.workers > 1 or args.coordinator:
+            raise SystemExit('--instrument renders serially; drop --workers/--coordinator')
+        img, report = geodesic_instrument.render_instrumented(W, H, r_obs, b_scale, camera=camera,
+                                                              engine=args.engine, by=args.instrument_by,
+                                                              tile=args.tile, **params)
+        for path in geodesic_instrument.save_report(report, args.instrument):
+            print(f'Saved {path}')
+        return img
+    if args.progressive:
+        if args.workers > 1 or args.coordinator:
+            raise SystemExit('--progressive renders serially; drop --workers/--coordinator')
+        return geodesic_progressive.render_progressive(W, H, r_obs, b_scale, camera=camera, engine=args.engine,
+                                                       strides=args.strides, threshold=args.refine_threshold,
+                                                       preview_path=args.preview, **params)
+    if args.aa > 1:
+        if args.workers > 1 or args.coordinator:
+            raise SystemExit('--aa renders serially; drop --workers/--coordinator')
+        counts = {}
+        img = geodesic_supersample.render_supersampled(W, H, r_obs, b_scale, camera=camera, engine=args.engine,
+                                                       samples=args.aa, phi_threshold=args.aa_threshold,
+                                                       counts=counts, **params)
+        print(f"  supersampled {counts['edge_pixels']} edge pixels, {counts['rays'] / (W*H):.2f} rays/pixel")
+        return img
+    if args.coordinator:
+        address = geodesic_cluster.parse_address(args.coordinator, default_host='0.0.0.0')
+        render = dict(params, r_obs=r_obs, b_scale=b_scale, camera=camera, engine=args.engine)
+        return geodesic_cluster.serve(W, H, render, address, tile=args.tile, lease=args.lease,
+                                      local_workers=args.local_workers, retries=args.retries)
+    if args.workers > 1:
+        return geodesic_tiles.render_parallel(W, H, r_obs, b_scale, camera=camera, engine=args.engine,
+                                              workers=args.workers, tile=args.tile, **params)
+    return geodesic_camera.render(W, H, r_obs, b_scale, camera=camera, engine=args.engine, **params)
+
+
+def output_name(name, args):
+    """Suffix the script's PNG name with the camera, e.g. geodesic_out_pinhole.png."""
+    if args.camera == 'none':
+        return name
+    stem, ext = name.rsplit('.', 1)
+    return f'{stem}_{args.camera}.{ext}'
@@ -0,0 +1,333 @@
+"""Coordinator / worker tile distribution over TCP for the geodesic renderers.
+
+The coordinator owns the framebuffer and a queue of tiles.  Workers on any
+host connect, pull one job at a time (tile bounds plus the render
+parameters), render it with `geodesic_tiles.render_tile` and stream the tile
+back.  A job is a lease: the worker sends heartbeats while it renders, and a
+tile whose lease expires, whose worker disconnects or whose result does not
+match its bounds goes back to the front of the queue, up to `retries` times
+before the render fails.  The first result for a tile wins; late duplicates
+are dropped.  The render also fails once every local worker has exited, no
+remote worker is connected and no tile has finished for a lease period.
+
+Wire format: every message is struct '!II' (header length, payload length),
+a UTF-8 JSON header, then a raw payload (the tile's uint8 RGB bytes for
+'result' messages, empty otherwise).
+
+    worker -> coordinator: hello, request, heartbeat{tile}, result{tile, shape, elapsed}
+    coordinator -> worker: job{tile, bounds, render} | wait{seconds} | done
+
+Usage:
+    python geodesic_rk4_adaptive.py --camera pinhole --coordinator 0.0.0.0:5555
+    python geodesic_cluster.py worker coordinator-host:5555       (on each render host)
+    python geodesic_rk4_adaptive.py --coordinator 127.0.0.1:5555 --local-workers 4
+"""
+import argparse
+import collections
+import json
+import multiprocessing as mp
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+
+import geodesic_tiles
+
+_FRAME = struct.Struct('!II')
+
+
+def send_msg(sock, header, payload=b''):
+    blob = json.dumps(header).encode('utf-8')
+    sock.sendall(_FRAME.pack(len(blob), len(payload)) + blob + payload)
+
+
+def _recv_exact(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_msg(sock):
+    n_header, n_payload = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    header = json.loads(_recv_exact(sock, n_header).decode('utf-8'))
+    return header, _recv_exact(sock, n_payload) if n_payload else b''
+
+
+def parse_address(text, default_host='127.0.0.1'):
+    host, _, port = text.rpartition(':')
+    return host or default_host, int(port)
+
+
+class Coordinator:
+    """Tile queue, leases and framebuffer shared by the connection handlers."""
+
+    def __init__(self, W, H, render, tile=64, lease=30.0, progress=True, retries=3):
+        self.W, self.H = W, H
+        self.render = render
+        self.tiles = list(geodesic_tiles.iter_tiles(W, H, tile))
+        self.pending = collections.deque(range(len(self.tiles)))
+        self.leases = {}          # tile id -> (worker, deadline)
+        self.done = set()
+        self.failures = collections.Counter()  # tile id -> times requeued
+        self.retries = retries
+        self.error = None
+        self.connected = 0
+        self.lease = lease
+        self.progress = progress
+        self.buf = np.zeros((H, W, 3), dtype=np.uint8)
+        self.cond = threading.Condition()
+        self.t0 = time.perf_counter()
+        self.last_done = time.monotonic()
+
+    @property
+    def finished(self):
+        return len(self.done) == len(self.tiles)
+
+    def checkout(self, worker):
+        """Next job header for `worker`."""
+        with self.cond:
+            self._reap()
+            if self.finished or self.error:
+                return {'type': 'done'}
+            if not self.pending:
+                return {'type': 'wait', 'seconds': 0.5}
+            tid = self.pending.popleft()
+            self.leases[tid] = (worker, time.monotonic() + self.lease)
+            return {'type': 'job', 'tile': tid, 'bounds': self.tiles[tid], 'render': self.render}
+
+    def heartbeat(self, worker, tid):
+        with self.cond:
+            if tid in self.leases and self.leases[tid][0] == worker:
+                self.leases[tid] = (worker, time.monotonic() + self.lease)
+
+    def complete(self, worker, tid, shape, payload):
+        """Store a result; one whose shape or size does not match the tile is rejected and the tile requeued."""
+        with self.cond:
+            if not isinstance(tid, int) or not 0 <= tid < len(self.tiles):
+                if self.progress:
+                    print(f'  result for unknown tile {tid!r} from {worker} dropped')
+                return
+            if tid in self.done:
+                self.leases.pop(tid, None)
+                return
+            x0, y0, x1, y1 = self.tiles[tid]
+            expected = (y1 - y0, x1 - x0, 3)
+            if tuple(shape or ()) != expected or len(payload) != expected[0] * expected[1] * 3:
+                if self.leases.pop(tid, None) is not None:
+                    self._requeue(tid, f'result {shape} ({len(payload)} bytes) from {worker} '
+                                       f'does not match {expected}')
+                return
+            self.leases.pop(tid, None)
+            self.buf[y0:y1, x0:x1] = np.frombuffer(payload, dtype=np.uint8).reshape(expected)
+            self.done.add(tid)
+            self.last_done = time.monotonic()
+            if tid in self.pending:
+                self.pending.remove(tid)
+            if self.progress:
+                print(f'  tile {len(self.done)}/{len(self.tiles)} from {worker}  '
+                      f'{time.perf_counter() - self.t0:.1f}s')
+            self.cond.notify_all()
+
+    def release(self, worker):
+        """Requeue every tile leased to a worker that went away."""
+        with self.cond:
+            lost = [tid for tid, (w, _) in self.leases.items() if w == worker]
+            for tid in lost:
+                del self.leases[tid]
+                self._requeue(tid, f'worker {worker} lost')
+
+    def _requeue(self, tid, why):
+        """Put a failed tile back at the front of the queue, or fail the render after `retries` requeues."""
+        self.failures[tid] += 1
+        if self.failures[tid] > self.retries:
+            self.error = f'tile {tid} {self.tiles[tid]} failed {self.failures[tid]} times, last: {why}'
+            self.cond.notify_all()
+            return
+        self.pending.appendleft(tid)
+        if self.progress:
+            print(f'  {why}, requeued tile {tid} ({self.failures[tid]}/{self.retries})')
+
+    def _reap(self):
+        now = time.monotonic()
+        expired = [tid for tid, (_, deadline) in self.leases.items() if deadline < now]
+        for tid in expired:
+            worker, _ = self.leases.pop(tid)
+            self._requeue(tid, f'lease held by {worker} expired')
+
+    def wait(self, poll=1.0, procs=()):
+        """Block until every tile is done.
+
+        Raises RuntimeError when a tile runs out of retries, or when all of the
+        local worker processes `procs` have exited, no worker is connected and
+        no tile has finished for a lease period.
+        """
+        with self.cond:
+            while not self.finished:
+                self._reap()
+                if (not self.error and procs and not self.connected and not any(p.is_alive() for p in procs)
+                        and time.monotonic() - self.last_done > self.lease):
+                    self.error = (f'all {len(procs)} local worker(s) exited and no worker is connected; '
+                                  f'{len(self.tiles) - len(self.done)} tile(s) left')
+                if self.error:
+                    raise RuntimeError(self.error)
+                self.cond.wait(poll)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        coord = self.server.coordinator
+        worker = '%s:%d' % self.client_address
+        with coord.cond:
+            coord.connected += 1
+        try:
+            while True:
+                header, payload = recv_msg(self.request)
+                kind = header.get('type')
+                if kind == 'hello':
+                    worker = f"{header.get('worker', worker)}@{self.client_address[0]}"
+                elif kind == 'request':
+                    reply = coord.checkout(worker)
+                    send_msg(self.request, reply)
+                    if reply['type'] == 'done':
+                        return
+                elif kind == 'heartbeat':
+                    coord.heartbeat(worker, header['tile'])
+                elif kind == 'result':
+                    coord.complete(worker, header.get('tile'), header.get('shape'), payload)
+        except (ConnectionError, OSError, struct.error, ValueError):
+            # ValueError: a header that is not JSON
+            pass
+        finally:
+            coord.release(worker)
+            with coord.cond:
+                coord.connected -= 1
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(W, H, render, address=('0.0.0.0', 5555), tile=64, lease=30.0, local_workers=0, progress=True,
+          retries=3):
+    """Serve tiles until the image is complete; returns the (H, W, 3) uint8 framebuffer.
+
+    `render` holds the keyword arguments of `geodesic_tiles.render_tile`
+    (r_obs, b_scale, camera, engine and the integrator parameters) and must
+    be JSON serialisable.  local_workers > 0 also starts that many worker
+    processes on this machine.  Raises RuntimeError when a tile fails more
+    than `retries` times or every local worker has exited with none attached.
+    """
+    coord = Coordinator(W, H, dict(render, W=W, H=H), tile, lease, progress, retries)
+    server = _Server(address, _Handler)
+    server.coordinator = coord
+    host, port = server.server_address[:2]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if progress:
+        print(f'Coordinator on {host}:{port}: {len(coord.tiles)} tiles, lease {lease:g}s')
+    procs = []
+    for i in range(local_workers):
+        target = '127.0.0.1' if host in ('0.0.0.0', '') else host
+        p = mp.Process(target=run_worker, args=(target, port), kwargs=dict(name=f'local{i}', progress=False))
+        p.start()
+        procs.append(p)
+    try:
+        coord.wait(procs=procs)
+    finally:
+        server.shutdown()
+        server.server_close()
+        for p in procs:
+            p.join(timeout=10.0)
+    return coord.buf
+
+
+def _heartbeats(sock, lock, tid, stop, interval):
+    while not stop.wait(interval):
+        try:
+            with lock:
+                send_msg(sock, {'type': 'heartbeat', 'tile': tid})
+        except OSError:
+            return
+
+
+def run_worker(host, port, name=None, heartbeat=5.0, retry=30.0, progress=True):
+    """Pull and render tiles from a coordinator until it reports done."""
+    name = name or f'{socket.gethostname()}-{os.getpid()}'
+    deadline = time.monotonic() + retry
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except OSError:
+            # the coordinator may still be starting up
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+    lock = threading.Lock()
+    rendered = 0
+    with sock:
+        send_msg(sock, {'type': 'hello', 'worker': name})
+        while True:
+            try:
+                with lock:
+                    send_msg(sock, {'type': 'request'})
+                header, _ = recv_msg(sock)
+            except (ConnectionError, OSError):
+                # the coordinator finished (or died) between jobs
+                header = {'type': 'done'}
+            if header['type'] == 'done':
+                break
+            if header['type'] == 'wait':
+                time.sleep(header['seconds'])
+                continue
+            render = dict(header['render'])
+            W, H = render.pop('W'), render.pop('H')
+            stop = threading.Event()
+            beat = threading.Thread(target=_heartbeats, args=(sock, lock, header['tile'], stop, heartbeat),
+                                    daemon=True)
+            beat.start()
+            t0 = time.perf_counter()
+            try:
+                tile = np.ascontiguousarray(geodesic_tiles.render_tile(header['bounds'], W, H, **render))
+            finally:
+                stop.set()
+                beat.join()
+            try:
+                with lock:
+                    send_msg(sock, {'type': 'result', 'tile': header['tile'], 'shape': list(tile.shape),
+                                    'elapsed': time.perf_counter() - t0}, tile.tobytes())
+            except OSError:
+                # the coordinator finished (or died) while this tile rendered; if it is still
+                # running, the tile's lease expires and another worker renders it
+                if progress:
+                    print(f'{name}: coordinator went away, dropping tile {header["tile"]}')
+                break
+            rendered += 1
+            if progress:
+                print(f'{name}: tile {header["tile"]} {header["bounds"]} {time.perf_counter() - t0:.2f}s')
+    if progress:
+        print(f'{name}: coordinator done, rendered {rendered} tile(s)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Geodesic render worker')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    w = sub.add_parser('worker', help='pull tiles from a coordinator')
+    w.add_argument('address', help='coordinator HOST:PORT')
+    w.add_argument('--name', default=None, help='worker name shown by the coordinator')
+    w.add_argument('--heartbeat', type=float, default=5.0, help='seconds between heartbeats')
+    args = parser.parse_args(argv)
+    host, port = parse_address(args.address)
+    run_worker(host, port, name=args.name, heartbeat=args.heartbeat)
+
+
+if __name__ == '__main__':
+    main()
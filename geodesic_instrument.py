@@ -0,0 +1,128 @@
+"""Per-ray instrumentation for the geodesic renderers: where the step budget goes.
+
+`render_instrumented` renders row by row (or tile by tile) with the batch
+engine's `ray_stats` hook switched on and keeps, per pixel, the attempted
+steps, rejected steps, smallest step size tried and termination reason,
+plus the wall time of every row or tile.  `save_report` writes
+
+- <prefix>.npz       the per-pixel arrays and per-band timings
+- <prefix>.json      a summary: pixels and steps per termination reason,
+                     step-count percentiles, pixels that hit max_steps,
+                     slowest bands
+- <prefix>_steps.png log-scaled step-count heatmap, max_steps hits in cyan
+- <prefix>_time.png  wall time per row/tile
+
+Without instrumentation the integrators skip all of this bookkeeping.
+"""
+import json
+import time
+import numpy as np
+from PIL import Image
+
+import geodesic_batch
+import geodesic_camera
+import geodesic_tiles
+
+REASONS = {
+    geodesic_batch.CAPTURED: 'captured',
+    geodesic_batch.ESCAPED: 'escaped',
+    geodesic_batch.TURNING: 'turning',
+    geodesic_batch.EXHAUSTED: 'max_steps',
+}
+
+# black -> purple -> orange -> pale yellow
+_RAMP = np.array([[0, 0, 4], [87, 16, 110], [188, 55, 84], [249, 142, 9], [252, 255, 164]], dtype=np.float64)
+EXHAUSTED_COLOUR = (0, 255, 255)
+
+
+def iter_rows(W, H):
+    for y in range(H):
+        yield 0, y, W, y + 1
+
+
+def render_instrumented(W, H, r_obs, b_scale, camera='pinhole', engine='batch', by='row', tile=64,
+                        **params):
+    """Render serially and return (img, report) where report holds the per-pixel counters and timings."""
+    bands = list(iter_rows(W, H) if by == 'row' else geodesic_tiles.iter_tiles(W, H, tile))
+    img = np.zeros((H, W, 3), dtype=np.uint8)
+    report = {
+        'steps': np.zeros((H, W), dtype=np.int64),
+        'rejected': np.zeros((H, W), dtype=np.int64),
+        'h_min': np.full((H, W), np.nan),
+        'status': np.zeros((H, W), dtype=np.int8),
+        'bounds': np.array(bands, dtype=np.int32).reshape(-1, 4),
+        'seconds': np.zeros(len(bands)),
+    }
+    for i, (x0, y0, x1, y1) in enumerate(bands):
+        px, py = geodesic_camera.pixel_centres(W, H, x0, y0, x1, y1)
+        ray_stats = {}
+        t0 = time.perf_counter()
+        traced = geodesic_camera.trace(px, py, W, H, r_obs, b_scale, camera, engine, ray_stats=ray_stats,
+                                       **params)
+        img[y0:y1, x0:x1] = geodesic_camera.shade(*traced, r_obs, camera)
+        report['seconds'][i] = time.perf_counter() - t0
+        report['status'][y0:y1, x0:x1] = traced[1]
+        for key, value in ray_stats.items():
+            report[key][y0:y1, x0:x1] = value
+    report['max_steps'] = params.get('max_steps', 200000)
+    return img, report
+
+
+def summary(report):
+    """JSON-ready digest of a report."""
+    steps, status = report['steps'], report['status']
+    total = int(steps.sum())
+    reasons = {}
+    for code, name in REASONS.items():
+        sel = status == code
+        reasons[name] = {'pixels': int(sel.sum()), 'steps': int(steps[sel].sum()),
+                         'step_share': float(steps[sel].sum() / total) if total else 0.0}
+    h = report['h_min'][np.isfinite(report['h_min'])]
+    order = np.argsort(report['seconds'])[::-1][:10]
+    return {
+        'pixels': int(steps.size),
+        'max_steps': int(report['max_steps']),
+        'total_steps': total,
+        'total_rejected': int(report['rejected'].sum()),
+        'steps_percentiles': {str(q): float(np.percentile(steps, q)) for q in (50, 90, 99, 100)},
+        'h_min': float(h.min()) if h.size else None,
+        'reasons': reasons,
+        'exhausted_pixels': reasons['max_steps']['pixels'],
+        'seconds': float(report['seconds'].sum()),
+        'slowest': [{'bounds': report['bounds'][i].tolist(), 'seconds': float(report['seconds'][i])}
+                    for i in order],
+    }
+
+
+def colormap(x):
+    """Map x in [0, 1] to uint8 RGB along the heatmap ramp."""
+    t = np.clip(np.nan_to_num(x), 0.0, 1.0) * (len(_RAMP) - 1)
+    i = np.minimum(t.astype(np.int64), len(_RAMP) - 2)
+    f = (t - i)[..., None]
+    return ((1.0 - f)*_RAMP[i] + f*_RAMP[i + 1]).astype(np.uint8)
+
+
+def steps_heatmap(report):
+    steps = report['steps']
+    top = np.log1p(max(int(steps.max()), 1))
+    img = colormap(np.log1p(steps) / top)
+    img[report['status'] == geodesic_batch.EXHAUSTED] = EXHAUSTED_COLOUR
+    return img
+
+
+def time_heatmap(report):
+    H, W = report['steps'].shape
+    per_pixel = np.zeros((H, W))
+    for (x0, y0, x1, y1), sec in zip(report['bounds'], report['seconds']):
+        # seconds per pixel, so rows and tiles of different sizes compare
+        per_pixel[y0:y1, x0:x1] = sec / ((x1 - x0) * (y1 - y0))
+    return colormap(per_pixel / max(per_pixel.max(), 1e-30))
+
+
+def save_report(report, prefix):
+    np.savez_compressed(f'{prefix}.npz', **report)
+    with open(f'{prefix}.json', 'w', encoding='utf-8') as f:
+        json.dump(summary(report), f, indent=1)
+    Image.fromarray(steps_heatmap(report), 'RGB').save(f'{prefix}_steps.png')
+    Image.fromarray(time_heatmap(report), 'RGB').save(f'{prefix}_time.png')
+    return [f'{prefix}.npz', f'{prefix}.json', f'{prefix}_steps.png', f'{prefix}_time.png']
@@ -0,0 +1,158 @@
+"""Step functions and step-size control for the batch geodesic engine.
+
+Methods (the `method=` argument of `geodesic_batch.integrate_batch`):
+- rk4      : classic RK4 with step-doubling error estimate and the x grow / x0.5
+             step rule of `integrate_pixel_adaptive` (10 dr_dphi per attempt, plus k1
+             at the new point after an accepted step)
+- dopri5   : Dormand-Prince 5(4) embedded pair, FSAL (6 dr_dphi per attempt)
+- cashkarp : Cash-Karp 5(4) embedded pair (6 dr_dphi per attempt, k1 reused on reject)
+             Both end a ray with `turning_sweep` once the next step would reach
+             periastron, where the square root of dr_dphi is singular
+- binet    : Dormand-Prince on the Binet form u'' = -u + 3/2 r_s u^2 (u = 1/r); no
+             square root, periastron located where u' = 0 (`geodesic_batch.integrate_binet`)
+
+Embedded pairs use a PI step-size controller on the scaled error
+err / (atol + rtol*|r|).  All step functions work on arrays of rays.
+"""
+import math
+import numpy as np
+
+
+class Tableau:
+    """Butcher tableau of an explicit embedded pair; `e` = b - b_hat gives the error estimate."""
+
+    def __init__(self, name, c, a, b, e, order, fsal):
+        self.name = name
+        self.c = c
+        self.a = a
+        self.b = b
+        self.e = e
+        self.order = order    # order of the error estimator + 1 sets the controller exponents
+        self.fsal = fsal
+        self.stages = len(c)
+
+
+DOPRI5 = Tableau(
+    'dopri5',
+    c=[0.0, 1/5, 3/10, 4/5, 8/9, 1.0, 1.0],
+    a=[[],
+       [1/5],
+       [3/40, 9/40],
+       [44/45, -56/15, 32/9],
+       [19372/6561, -25360/2187, 64448/6561, -212/729],
+       [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+       [35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84]],
+    b=[35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84, 0.0],
+    e=[71/57600, 0.0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40],
+    order=5,
+    fsal=True,
+)
+
+CASH_KARP = Tableau(
+    'cashkarp',
+    c=[0.0, 1/5, 3/10, 3/5, 1.0, 7/8],
+    a=[[],
+       [1/5],
+       [3/40, 9/40],
+       [3/10, -9/10, 6/5],
+       [-11/54, 5/2, -70/27, 35/27],
+       [1631/55296, 175/512, 575/13824, 44275/110592, 253/4096]],
+    b=[37/378, 0.0, 250/621, 125/594, 0.0, 512/1771],
+    e=[37/378 - 2825/27648, 0.0, 250/621 - 18575/48384, 125/594 - 13525/55296,
+       -277/14336, 512/1771 - 1/4],
+    order=5,
+    fsal=False,
+)
+
+TABLEAUS = {t.name: t for t in (DOPRI5, CASH_KARP)}
+METHODS = ('rk4',) + tuple(TABLEAUS) + ('binet',)
+
+# Gauss-Legendre rule on [0, 1] for `turning_sweep`
+_GL_X, _GL_W = np.polynomial.legendre.leggauss(8)
+GL_NODES, GL_WEIGHTS = 0.5 * (_GL_X + 1.0), 0.5 * _GL_W
+
+# PI controller constants (Hairer/Wanner style, exponents scaled by 1/order)
+SAFETY = 0.9
+FAC_MIN = 0.2
+FAC_MAX = 5.0
+PI_ALPHA = 0.7
+PI_BETA = 0.4
+
+
+def error_scale(r, r_new, atol, rtol):
+    with np.errstate(invalid='ignore'):
+        return atol + rtol * np.maximum(np.abs(r), np.abs(r_new))
+
+
+def rk4_doubling_step(f, r, h, k1):
+    """Full step vs two half steps; returns (r_new, |error|, nfev).  h is signed."""
+    def rk4(r0, hh, k):
+        k2 = f(r0 + 0.5*hh*k)
+        k3 = f(r0 + 0.5*hh*k2)
+        k4 = f(r0 + hh*k3)
+        return r0 + (hh/6.0)*(k + 2*k2 + 2*k3 + k4)
+    r_full = rk4(r, h, k1)
+    r_half = rk4(r, 0.5*h, k1)
+    r_half2 = rk4(r_half, 0.5*h, f(r_half))
+    return r_half2, np.abs(r_half2 - r_full), 10
+
+
+def embedded_step(tab, f, r, h, k1):
+    """One attempt of an embedded pair; returns (r_new, |error|, k_last or None, nfev).
+
+    k_last is f(r_new) for FSAL tableaus and becomes the next k1 if the step is accepted.
+    """
+    k = [k1]
+    for i in range(1, tab.stages):
+        acc = r
+        for j, aij in enumerate(tab.a[i]):
+            if aij:
+                acc = acc + h * aij * k[j]
+        k.append(f(acc))
+    if tab.fsal:
+        # last stage was evaluated at r + h * sum(b_j k_j) = r_new
+        r_new = r + h * sum(bj * kj for bj, kj in zip(tab.a[-1], k) if bj)
+    else:
+        r_new = r + h * sum(bj * kj for bj, kj in zip(tab.b, k) if bj)
+    err = np.abs(h * sum(ej * kj for ej, kj in zip(tab.e, k) if ej))
+    return r_new, err, (k[-1] if tab.fsal else None), tab.stages - 1
+
+
+def pi_step_factor(err, err_prev, order, accepted):
+    """Step multiplier from the scaled error (err <= 1 accepts) and the last accepted error."""
+    with np.errstate(divide='ignore'):
+        e = np.maximum(err, 1e-10)
+        fac_acc = SAFETY * e**(-PI_ALPHA/order) * np.maximum(err_prev, 1e-4)**(PI_BETA/order)
+        fac_rej = SAFETY * e**(-1.0/order)
+    return np.where(accepted, np.clip(fac_acc, FAC_MIN, FAC_MAX), np.clip(fac_rej, FAC_MIN, 1.0))
+
+
+def periastron(L, r_s=1.0, E=1.0):
+    """Turning radius of each ray, the largest root of (E/L)^2 r^3 - r + r_s; NaN for captured rays."""
+    b = np.asarray(L, dtype=np.float64) / E
+    b_c = 1.5 * math.sqrt(3.0) * r_s
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r_p = 2.0 * b / math.sqrt(3.0) * np.cos(np.arccos(-b_c / b) / 3.0)
+    return np.where(b > b_c, r_p, np.nan)
+
+
+def turning_sweep(r, r_p, L, E=1.0):
+    """phi swept from r down to periastron r_p; returns (phi, nfev).
+
+    (dr/dphi)^2 = r (r - r_p) Q(r) with Q(r) = a r^2 + a r_p r + a r_p^2 - 1,
+    a = (E/L)^2, so with r = r_p + w^2 the sweep is the integral of the
+    smooth 2 / sqrt(r Q(r)) over w in [0, sqrt(r - r_p)] (Gauss-Legendre).
+    """
+    a = (E / L)**2
+    w0 = np.sqrt(np.maximum(r - r_p, 0.0))
+    x = r_p + (w0 * GL_NODES[:, None])**2
+    q = x * (a*x*x + a*r_p*x + a*r_p*r_p - 1.0)
+    return 2.0 * w0 * np.sum(GL_WEIGHTS[:, None] / np.sqrt(q), axis=0), len(GL_NODES)
+
+
+def binet_rhs(r_s):
+    """f(y) for y = (u, du/dphi) stacked on axis 0; both components are polynomials in u."""
+    def f(y):
+        u, v = y[0], y[1]
+        return np.stack([v, -u + 1.5*r_s*u*u])
+    return f
@@ -0,0 +1,161 @@
+"""Persistent deflection-angle lookup table for the geodesic renderers.
+
+The final phi of a ray depends only on |b|, so instead of integrating every
+pixel we integrate phi(b) once on a non-uniform grid that is packed around the
+critical impact parameter b_c = 3*sqrt(3)/2 * r_s, refine it until linear
+interpolation agrees with freshly integrated midpoints, and store the table
+on disk keyed by the integration parameters.  Renders with the same physics
+then reduce to a cache load plus a vectorized lookup.
+
+phi(b) depends on r_obs only through the sweep between two observer radii,
+which is closed-form (geodesic_elliptic), so `lookup(b, r_obs)` serves any
+other observer radius from one table by adding that exact difference.
+"""
+import hashlib
+import json
+import math
+import os
+import numpy as np
+
+import geodesic_batch
+import geodesic_elliptic
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(DIR, 'lut_cache')
+
+# bump when the table layout or the refinement rule changes
+LUT_VERSION = 1
+
+# tables already loaded by this process, by cache path
+_loaded = {}
+
+
+def critical_impact_parameter(r_s=1.0):
+    return 1.5 * math.sqrt(3.0) * r_s
+
+
+def initial_grid(b_max, r_s=1.0, n=257):
+    """Grid on [0, b_max] with quadratic clustering towards b_c."""
+    b_c = critical_impact_parameter(r_s)
+    s = np.linspace(0.0, 1.0, n // 2 + 1)
+    inner = b_c * (1.0 - s**2)
+    if b_max <= b_c:
+        return np.unique(inner[inner <= b_max])
+    outer = b_c + (b_max - b_c) * s**2
+    return np.unique(np.concatenate([inner, outer]))
+
+
+class DeflectionLUT:
+    """phi(|b|) and termination status sampled on a refined grid."""
+
+    def __init__(self, b, phi, status, params):
+        self.b = b
+        self.phi = phi
+        self.status = status
+        self.params = params
+
+    @property
+    def b_max(self):
+        return float(self.b[-1])
+
+    @classmethod
+    def build(cls, b_max, r_obs, lut_tol=1e-3, min_width=1e-7, max_levels=40, n=257, **params):
+        """Integrate phi(b) on [0, b_max] and bisect intervals until the midpoint error is below lut_tol.
+
+        An interval is refined while linear interpolation misses the integrated
+        midpoint by more than lut_tol or while its ends disagree on status
+        (the capture boundary); intervals narrower than min_width are final.
+        """
+        r_s = params.get('r_s', 1.0)
+        b = initial_grid(b_max, r_s, n)
+        phi, status = geodesic_batch.integrate_batch(b, r_obs, **params)
+        todo = np.ones(b.size - 1, dtype=bool)
+        for _ in range(max_levels):
+            todo &= np.diff(b) > min_width
+            if not todo.any():
+                break
+            lo = np.nonzero(todo)[0]
+            mid = 0.5 * (b[lo] + b[lo + 1])
+            pm, sm = geodesic_batch.integrate_batch(mid, r_obs, **params)
+            captured = ((status[lo] == geodesic_batch.CAPTURED) & (status[lo + 1] == geodesic_batch.CAPTURED)
+                        & (sm == geodesic_batch.CAPTURED))
+            err = np.where(captured, 0.0, np.abs(pm - 0.5 * (phi[lo] + phi[lo + 1])))
+            bad = (err > lut_tol) | (status[lo] != sm) | (status[lo + 1] != sm)
+
+            b = np.concatenate([b, mid])
+            phi = np.concatenate([phi, pm])
+            status = np.concatenate([status, sm])
+            bad_node = np.concatenate([np.zeros(b.size - mid.size, dtype=bool), bad])
+            order = np.argsort(b, kind='stable')
+            b, phi, status, bad_node = b[order], phi[order], status[order], bad_node[order]
+            # only the two halves of a failed interval are tested again
+            todo = bad_node[:-1] | bad_node[1:]
+        return cls(b, phi, status, dict(params, r_obs=r_obs, lut_tol=lut_tol, min_width=min_width))
+
+    def lookup(self, b, r_obs=None):
+        """Return (phi, status) for an array of impact parameters of any shape, at r_obs (default: the table's)."""
+        x = np.abs(np.asarray(b, dtype=np.float64))
+        if x.size and x.max() > self.b_max:
+            raise ValueError(f'impact parameter {x.max():g} outside table range {self.b_max:g}')
+        i = np.clip(np.searchsorted(self.b, x, side='right') - 1, 0, self.b.size - 2)
+        b0, b1 = self.b[i], self.b[i + 1]
+        t = (x - b0) / (b1 - b0)
+        s0, s1 = self.status[i], self.status[i + 1]
+        phi = self.phi[i] + t * (self.phi[i + 1] - self.phi[i])
+        # across a status change interpolation is meaningless; take the nearest node
+        nearest = np.where(t < 0.5, i, i + 1)
+        split = s0 != s1
+        phi = np.where(split, self.phi[nearest], phi)
+        status = np.where(split, self.status[nearest], s0)
+        r_ref = self.params['r_obs']
+        if r_obs is not None and float(r_obs) != r_ref:
+            # same orbit, different start: add the exact sweep between the two observer radii
+            physics = {k: self.params[k] for k in ('r_s', 'E') if k in self.params}
+            phi = (phi + geodesic_elliptic.deflect(x, r_obs, **physics)[0]
+                   - geodesic_elliptic.deflect(x, r_ref, **physics)[0])
+        return phi, status.astype(np.int8)
+
+    def save(self, path):
+        tmp = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp, b=self.b, phi=self.phi, status=self.status,
+                 params=np.array(json.dumps(self.params, sort_keys=True)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['b'], data['phi'], data['status'], json.loads(str(data['params'])))
+
+
+def cache_key(r_obs, **params):
+    """Stable hash of everything that changes phi(b): r_s, r_obs, tol, h_min, h_max, max_steps, ..."""
+    key = dict(params, r_obs=float(r_obs), version=LUT_VERSION)
+    blob = json.dumps(key, sort_keys=True, default=float)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()[:16]
+
+
+def get_lut(b_max, r_obs, cache_dir=CACHE_DIR, lut_tol=1e-3, **params):
+    """Load the table for these parameters from cache_dir, building (and saving) it if needed."""
+    path = os.path.join(cache_dir, f'phi_lut_{cache_key(r_obs, lut_tol=lut_tol, **params)}.npz')
+    lut = _loaded.get(path)
+    if lut is not None and lut.b_max >= b_max:
+        return lut
+    if os.path.exists(path):
+        lut = DeflectionLUT.load(path)
+        if lut.b_max >= b_max:
+            _loaded[path] = lut
+            return lut
+        # cached table is too narrow; rebuild over the wider range
+        b_max = max(b_max, lut.b_max)
+    lut = DeflectionLUT.build(b_max, r_obs, lut_tol=lut_tol, **params)
+    os.makedirs(cache_dir, exist_ok=True)
+    lut.save(path)
+    _loaded[path] = lut
+    return lut
+
+
+def render(W, H, r_obs, b_scale, cache_dir=CACHE_DIR, lut_tol=1e-3, **params):
+    """LUT-backed equivalent of `geodesic_batch.render`."""
+    lut = get_lut(abs(b_scale), r_obs, cache_dir=cache_dir, lut_tol=lut_tol, **params)
+    phi, status = lut.lookup(geodesic_batch.screen_impact_parameters(W, H, b_scale))
+    return geodesic_batch.shade(phi, status)
@@ -0,0 +1,130 @@
+"""Progressive coarse-to-fine rendering for the geodesic renderers.
+
+Pass 0 integrates every stride-th pixel in x and y (1/16 of the image for
+stride 4) and writes a block-upsampled preview.  Each further pass halves
+(or otherwise divides) the stride: a new sample is integrated only when the
+corners of its coarse cell or of a neighbouring cell disagree (capture
+status differs, or a colour channel spans more than `threshold` levels), or
+the cell runs off the image edge; elsewhere it is filled bilinearly from the
+corners.  Every integrated or filled sample is kept and becomes a corner for
+the next pass, so nothing is traced twice.  threshold=0 integrates every pixel and gives
+exactly the one-shot image.
+
+After each pass the preview file is rewritten; interrupting with Ctrl-C
+keeps the image of the last finished pass.
+"""
+import time
+import numpy as np
+from PIL import Image
+
+import geodesic_batch
+import geodesic_camera
+
+STRIDES = (4, 2, 1)
+
+
+def trace_pixels(ix, iy, W, H, r_obs, b_scale, camera, engine, **params):
+    """Colours and capture flags for integer pixel indices."""
+    traced = geodesic_camera.trace(ix + 0.5, iy + 0.5, W, H, r_obs, b_scale, camera, engine, **params)
+    return geodesic_camera.shade(*traced, r_obs, camera), traced[1] == geodesic_batch.CAPTURED
+
+
+def lattice(W, H, stride):
+    """(ix, iy) of the stride lattice, flattened."""
+    iy, ix = np.mgrid[0:H:stride, 0:W:stride]
+    return ix.ravel(), iy.ravel()
+
+
+def preview(img, stride):
+    """Fill the image from its stride lattice by nearest-lower sample (block upsampling)."""
+    H, W = img.shape[:2]
+    ys = np.arange(H) // stride * stride
+    xs = np.arange(W) // stride * stride
+    return img[ys[:, None], xs[None, :]]
+
+
+def _dilate(mask):
+    """3x3 binary dilation."""
+    pad = np.pad(mask, 1)
+    H, W = mask.shape
+    return np.any([pad[dy:dy + H, dx:dx + W] for dy in range(3) for dx in range(3)], axis=0)
+
+
+def refine(img, captured, stride, coarse, threshold):
+    """Split the new stride-lattice samples into (integrate, fill) for a pass following `coarse`.
+
+    A coarse cell is traced when its corners disagree or it touches the far
+    image edge; the flags are dilated by one cell so features thinner than a
+    cell that cross a neighbour are still caught.  Returns the integer
+    indices to integrate and, for the rest, the indices, bilinear colours
+    and capture flags filled from the cell corners.
+    """
+    H, W = captured.shape
+    ix, iy = lattice(W, H, stride)
+    new = (ix % coarse != 0) | (iy % coarse != 0)
+    ix, iy = ix[new], iy[new]
+    cx, cy = ix // coarse, iy // coarse
+    x0, y0 = cx * coarse, cy * coarse
+    x1, y1 = np.minimum(x0 + coarse, W - 1), np.minimum(y0 + coarse, H - 1)
+
+    # per-cell corner test on the coarse lattice; the last row/column of cells has no far corner
+    lat = img[0:H:coarse, 0:W:coarse].astype(np.float64)
+    lcap = captured[0:H:coarse, 0:W:coarse]
+    ny, nx = lcap.shape
+    c = [lat[:-1, :-1], lat[:-1, 1:], lat[1:, :-1], lat[1:, 1:]]
+    k = [lcap[:-1, :-1], lcap[:-1, 1:], lcap[1:, :-1], lcap[1:, 1:]]
+    spread = (np.maximum.reduce(c) - np.minimum.reduce(c)).max(axis=-1)
+    split = np.logical_or.reduce(k) != np.logical_and.reduce(k)
+    flag = np.ones((ny, nx), dtype=bool)
+    if threshold > 0:
+        flag[:-1, :-1] = (spread > threshold) | split
+    todo = _dilate(flag)[cy, cx]
+
+    keep = ~todo
+    ix_k, iy_k = ix[keep], iy[keep]
+    x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+    tx = ((ix_k - x0) / coarse)[:, None]
+    ty = ((iy_k - y0) / coarse)[:, None]
+    fill = ((1 - tx)*(1 - ty)*img[y0, x0] + tx*(1 - ty)*img[y0, x1]
+            + (1 - tx)*ty*img[y1, x0] + tx*ty*img[y1, x1])
+    return (ix[todo], iy[todo]), (ix_k, iy_k, np.rint(fill).astype(np.uint8), captured[y0, x0])
+
+
+def render_progressive(W, H, r_obs, b_scale, camera='pinhole', engine='batch', strides=STRIDES,
+                       threshold=8, preview_path=None, progress=True, **params):
+    """Render in coarse-to-fine passes; returns the (H, W, 3) uint8 image of the last finished pass."""
+    strides = sorted(set(strides), reverse=True)
+    if strides[-1] != 1 or any(a % b for a, b in zip(strides, strides[1:])):
+        raise ValueError(f'strides must divide each other and end at 1, got {strides}')
+    img = np.zeros((H, W, 3), dtype=np.uint8)
+    captured = np.zeros((H, W), dtype=bool)
+    result = None
+    t0 = time.perf_counter()
+    traced_total = 0
+    try:
+        for k, stride in enumerate(strides):
+            if k == 0:
+                todo, fill = lattice(W, H, stride), None
+            else:
+                todo, fill = refine(img, captured, stride, strides[k - 1], threshold)
+            ix, iy = todo
+            if ix.size:
+                img[iy, ix], captured[iy, ix] = trace_pixels(ix, iy, W, H, r_obs, b_scale, camera, engine,
+                                                             **params)
+            if fill is not None:
+                fx, fy, colour, cap = fill
+                img[fy, fx] = colour
+                captured[fy, fx] = cap
+            traced_total += ix.size
+            result = preview(img, stride)
+            if preview_path:
+                Image.fromarray(result, 'RGB').save(preview_path)
+            if progress:
+                filled = 0 if fill is None else fill[0].size
+                print(f'  pass {k + 1}/{len(strides)} stride {stride}: traced {ix.size} filled {filled} '
+                      f'({traced_total / (W*H):.1%} of pixels traced)  {time.perf_counter() - t0:.1f}s')
+    except KeyboardInterrupt:
+        if result is None:
+            raise
+        print('  interrupted; keeping the last finished pass')
+    return result
@@ -1,34 +1,12 @@
 import argparse
-
-# Parameters (can be overridden via CLI)
-parser = argparse.ArgumentParser(description='CPU adaptive RK4 equatorial null-geodesic renderer')
-parser.add_argument('--width', type=int, default=800, help='output width')
-parser.add_argument('--height', type=int, default=400, help='output height')
-parser.add_argument('--quick', action='store_true', help='run quick low-res/low-step test')
-parser.add_argument('--max-steps', type=int, default=200000, help='maximum integration steps per ray')
-args = parser.parse_args()
-
-W, H = (200, 100) if args.quick else (args.width, args.height)
-r_s = 1.0  # Schwarzschild radius
-r_obs = 100.0
-b_scale = 6.0
-E = 1.0
-
-# adaptive parameters
-h0 = 0.02
-import argparse
 import math
 from PIL import Image
 
-# Adaptive RK4 equatorial null-geodesic renderer
-# Usage: python geodesic_rk4_adaptive.py [--quick] [--width W] [--height H]
+import geodesic_batch
+import geodesic_cli
 
-parser = argparse.ArgumentParser(description='CPU adaptive RK4 equatorial null-geodesic renderer')
-parser.add_argument('--width', type=int, default=800, help='output width')
-parser.add_argument('--height', type=int, default=400, help='output height')
-parser.add_argument('--quick', action='store_true', help='run quick low-res/fast test')
-parser.add_argument('--max-steps', type=int, default=200000, help='maximum integration steps per ray')
-args = parser.parse_args()
+# Adaptive RK4 equatorial null-geodesic renderer
+# Usage: python geodesic_rk4_adaptive.py [--quick] [--width W] [--height H] [--engine batch|lut|scalar] [--camera none|pinhole|equirect]
 
 # geometry / physical params
 r_s = 1.0
@@ -41,9 +19,10 @@ h_init = 0.02
 h_min = 1e-5
 h_max = 0.1
 adapt_alpha = 5.0
-max_steps = args.max_steps if not args.quick else 20000
+max_steps = 200000
 
-W, H = (200, 100) if args.quick else (args.width, args.height)
+PARAMS = dict(r_s=r_s, E=E, tol=1e-3, h_init=h_init, h_min=h_min, h_max=h_max,
+              grow=1.5, max_steps=max_steps, phi_escape=0.05)
 
 def sample_background(phi):
     t = (phi / (2*math.pi)) % 1.0
@@ -65,7 +44,7 @@ def rk4_step(r, h, L):
     k4 = dr_dphi(r + h*k3, L)
     return r + (h/6.0)*(k1 + 2*k2 + 2*k3 + k4)
 
-def integrate_pixel_adaptive(b, r_obs, tol=1e-3):
+def integrate_pixel_adaptive(b, r_obs, tol=1e-3, max_steps=max_steps):
     L = abs(b) if abs(b) > 1e-8 else 1e-8
     r = r_obs
     phi = 0.0
@@ -102,92 +81,40 @@ def integrate_pixel_adaptive(b, r_obs, tol=1e-3):
         return None
     return phi
 
-def run():
+def run_scalar(W, H, max_steps):
     img = Image.new('RGB', (W, H))
     px = img.load()
-    print(f'Adaptive renderer {W}x{H} quick={args.quick} max_steps={max_steps}')
     for j in range(H):
         if j % max(1, H//10) == 0:
             print(f'  row {j}/{H}')
         for i in range(W):
             x = (i + 0.5) / W * 2.0 - 1.0
             b = x * b_scale
-            phi = integrate_pixel_adaptive(b, r_obs)
+            phi = integrate_pixel_adaptive(b, r_obs, max_steps=max_steps)
             if phi is None:
                 color = (0,0,0)
             else:
                 color = sample_background(phi)
             px[i,j] = color
+    return img
+
+def run(args):
+    W, H = (200, 100) if args.quick else geodesic_cli.frame_size(args, 800, 400)
+    steps = args.max_steps if not args.quick else 20000
+    print(f'Adaptive renderer {W}x{H} quick={args.quick} max_steps={steps} engine={args.engine} camera={args.camera}')
     out_name = 'geodesic_adaptive_quick.png' if args.quick else 'geodesic_adaptive_out.png'
-    img.save(out_name)
+    out_name = geodesic_cli.output_name(out_name, args)
+    buf = geodesic_cli.render(args, W, H, r_obs, b_scale, dict(PARAMS, max_steps=steps),
+                              lambda: run_scalar(W, H, steps))
+    geodesic_batch.save_png(buf, out_name)
     print(f'Saved {out_name}')
 
-if __name__ == '__main__':
-    run()
-
-def dr_dphi(r, L):
-    inside = E*E - (1 - r_s / r) * (L*L) / (r*r)
-    if inside <= 0:
-        return 0.0
-    return (r*r / L) * math.sqrt(inside)
-
-def rk4_step(r, h, L):
-    k1 = dr_dphi(r, L)
-    k2 = dr_dphi(r + 0.5*h*k1, L)
-    k3 = dr_dphi(r + 0.5*h*k2, L)
-    k4 = dr_dphi(r + h*k3, L)
-    return r + (h/6.0)*(k1 + 2*k2 + 2*k3 + k4)
-
-# adaptive per-pixel integration
-def integrate_pixel(b, r_obs, tol=1e-3, h_init=0.01, h_min=1e-5, h_max=0.1, max_steps=20000):
-    L = abs(b) if abs(b) > 1e-8 else 1e-8
-    r = r_obs
-    phi = 0.0
-    h = h_init
-    steps = 0
-    captured = False
-    escaped = False
-    while steps < max_steps:
-        if r <= r_s:
-            captured = True
-            break
-        r1 = rk4_step(r, -h, L)
-        r_half = rk4_step(r, -h*0.5, L)
-        r2 = rk4_step(r_half, -h*0.5, L)
-        err = abs(r2 - r1)
-        if err <= tol:
-            r = r2
-            phi += h
-            h = min(h*1.5, h_max)
-        else:
-            h = max(h*0.5, h_min)
-            if h <= h_min + 1e-12:
-                r = r2
-                phi += h
-        if math.isnan(r) or r <= 0:
-            captured = True
-            break
-        if r > r_obs * 0.995 and phi > 0.1:
-            escaped = True
-            break
-        steps += 1
-    if captured:
-        return None
-    return phi
-
-img = Image.new('RGB', (W,H))
-px = img.load()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='CPU adaptive RK4 equatorial null-geodesic renderer')
+    parser.add_argument('--quick', action='store_true', help='run quick low-res/fast test')
+    parser.add_argument('--max-steps', type=int, default=max_steps, help='maximum integration steps per ray')
+    geodesic_cli.add_render_args(parser)
+    return parser.parse_args(argv)
 
-for j in range(H):
-    for i in range(W):
-        x = (i + 0.5) / W * 2.0 - 1.0
-        b = x * b_scale
-        phi = integrate_pixel(b, r_obs)
-        if phi is None:
-            color = (0,0,0)
-        else:
-            color = sample_background(phi)
-        px[i,j] = color
-
-img.save('geodesic_adaptive_out.png')
-print('Saved geodesic_adaptive_out.png')
+if __name__ == '__main__':
+    run(parse_args())
@@ -1,9 +1,13 @@
 """Medium-res adaptive RK4 renderer.
 Produces geodesic_adaptive_medium.png
 """
+import argparse
 import math
 from PIL import Image
 
+import geodesic_batch
+import geodesic_cli
+
 W, H = 400, 200
 r_s = 1.0
 r_obs = 80.0
@@ -16,7 +20,9 @@ max_h = 0.2
 alpha = 5.0
 max_steps = 200000
 
-print('Medium render', W, 'x', H)
+# batch-engine settings; its per-ray step control replaces the alpha heuristic below
+PARAMS = dict(r_s=r_s, E=E, tol=1e-3, h_init=h0, h_min=min_h, h_max=max_h,
+              grow=1.3, max_steps=max_steps, phi_escape=0.05)
 
 def sample_background(phi):
     t = (phi / (2*math.pi)) % 1.0
@@ -38,48 +44,60 @@ def rk4_step(r, h, L):
     k4 = dr_dphi(r + h*k3, L)
     return r + (h/6.0)*(k1 + 2*k2 + 2*k3 + k4)
 
-img = Image.new('RGB', (W, H))
-px = img.load()
+def render_scalar(W=W, H=H):
+    img = Image.new('RGB', (W, H))
+    px = img.load()
 
-for j in range(H):
-    for i in range(W):
-        x = (i + 0.5) / W * 2.0 - 1.0
-        b = x * b_scale
-        L = abs(b)
-        if L < 1e-6:
-            L = 1e-6
-        r = r_obs
-        phi = 0.0
-        captured = False
-        steps = 0
-        while steps < max_steps:
-            if r <= r_s:
-                captured = True
-                break
-            deriv = dr_dphi(r, L)
-            if deriv == 0.0:
-                break
-            h = h0 / (1.0 + alpha * abs(deriv))
-            h = max(min_h, min(max_h, h))
-            r1 = rk4_step(r, -h, L)
-            r_half = rk4_step(r, -h*0.5, L)
-            r2 = rk4_step(r_half, -h*0.5, L)
-            err = abs(r2 - r1)
-            tol = 1e-3
-            if err <= tol:
-                r = r2
-                phi += h
-                h = min(h * 1.3, max_h)
+    for j in range(H):
+        for i in range(W):
+            x = (i + 0.5) / W * 2.0 - 1.0
+            b = x * b_scale
+            L = abs(b)
+            if L < 1e-6:
+                L = 1e-6
+            r = r_obs
+            phi = 0.0
+            captured = False
+            steps = 0
+            while steps < max_steps:
+                if r <= r_s:
+                    captured = True
+                    break
+                deriv = dr_dphi(r, L)
+                if deriv == 0.0:
+                    break
+                h = h0 / (1.0 + alpha * abs(deriv))
+                h = max(min_h, min(max_h, h))
+                r1 = rk4_step(r, -h, L)
+                r_half = rk4_step(r, -h*0.5, L)
+                r2 = rk4_step(r_half, -h*0.5, L)
+                err = abs(r2 - r1)
+                tol = 1e-3
+                if err <= tol:
+                    r = r2
+                    phi += h
+                    h = min(h * 1.3, max_h)
+                else:
+                    h = max(h * 0.5, min_h)
+                if r > r_obs * 0.995 and phi > 0.05:
+                    break
+                steps += 1
+            if captured:
+                color = (0,0,0)
             else:
-                h = max(h * 0.5, min_h)
-            if r > r_obs * 0.995 and phi > 0.05:
-                break
-            steps += 1
-        if captured:
-            color = (0,0,0)
-        else:
-            color = sample_background(phi)
-        px[i,j] = color
+                color = sample_background(phi)
+            px[i,j] = color
+    return img
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Medium-res adaptive RK4 renderer')
+    args = geodesic_cli.add_render_args(parser).parse_args(argv)
+    width, height = geodesic_cli.frame_size(args, W, H)
+    print('Medium render', width, 'x', height)
+    out_name = geodesic_cli.output_name('geodesic_adaptive_medium.png', args)
+    geodesic_batch.save_png(geodesic_cli.render(args, width, height, r_obs, b_scale, PARAMS,
+                                                 lambda: render_scalar(width, height)), out_name)
+    print('Saved', out_name)
 
-img.save('geodesic_adaptive_medium.png')
-print('Saved geodesic_adaptive_medium.png')
+if __name__ == '__main__':
+    main()
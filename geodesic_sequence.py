@@ -0,0 +1,288 @@
+"""Frame sequences along an interpolated parameter path for the geodesic renderers.
+
+A path is a list of keyframes, each giving some of r_obs, b_scale and roll
+(camera rotation about the line of sight, degrees) at a frame number;
+parameters are interpolated linearly (or with smoothstep easing) between
+keyframes.  Work is reused between frames:
+
+- roll only rotates psi, so a frame that changes nothing else is pure shading
+- phi(b) for each r_obs is kept in a radius cache, and a frame integrates only
+  the radii that earlier frames with the same physics did not already cover
+  (a b_scale zoom at fixed r_obs costs only its new radii); with --engine lut
+  one table, built at the first frame's r_obs, serves every frame through the
+  closed-form r_obs shift of `DeflectionLUT.lookup`
+
+Frames are handed to background encoder threads as soon as they are shaded,
+so integration never waits on PNG compression, and stream to
+<out_dir>/frame_0000.png, ...  With --apng the frames are finally assembled
+into one animated PNG.
+
+Usage:
+    python geodesic_sequence.py --frames 300 --r-obs 100 12 --b-scale 6 8 --roll 0 90 --out-dir flyin
+    python geodesic_sequence.py --path path.json --apng flyin.png
+where path.json is {"frames": 300, "keys": [{"frame": 0, "r_obs": 100}, {"frame": 299, "r_obs": 12}]}.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+from PIL import Image
+
+import geodesic_batch
+import geodesic_camera
+import geodesic_integrators
+import geodesic_lut
+import geodesic_sweep
+
+PATH_KEYS = ('r_obs', 'b_scale', 'roll')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def interpolate(keys, frames, ease=False):
+    """Per-frame parameter dicts from keyframes [{'frame': i, 'r_obs': ..., ...}, ...]."""
+    keys = sorted(keys, key=lambda k: k['frame'])
+    out = []
+    for name in PATH_KEYS:
+        pts = [(k['frame'], float(k[name])) for k in keys if name in k]
+        if not pts:
+            continue
+        xs, ys = zip(*pts)
+        f = np.arange(frames, dtype=np.float64)
+        if ease and len(xs) > 1:
+            # smoothstep within each keyframe segment
+            i = np.clip(np.searchsorted(xs, f, side='right') - 1, 0, len(xs) - 2)
+            x0, x1 = np.asarray(xs)[i], np.asarray(xs)[i + 1]
+            t = np.clip((f - x0) / np.maximum(x1 - x0, 1e-12), 0.0, 1.0)
+            f = x0 + (x1 - x0) * t*t*(3.0 - 2.0*t)
+        out.append((name, np.interp(f, xs, ys)))
+    return [{name: float(v[i]) for name, v in out} for i in range(frames)]
+
+
+class RadiusCache:
+    """phi/status for every radius integrated so far, per physics key (the last `keep` keys are kept)."""
+
+    def __init__(self, engine='batch', keep=2, **params):
+        self.engine = engine
+        self.params = params
+        self.keep = keep
+        self.tables = {}
+        self.lut = None
+        self.integrated = 0
+
+    def lookup(self, b, r_obs):
+        if self.engine == 'lut':
+            return self._lookup_lut(b, r_obs)
+        key = float(r_obs)
+        ub, phi, status = self.tables.pop(key, (np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int8)))
+        need = np.unique(b)
+        missing = np.setdiff1d(need, ub, assume_unique=True)
+        if missing.size:
+            pm, sm = geodesic_camera.integrate_unique(missing, r_obs, engine=self.engine, **self.params)
+            self.integrated += missing.size
+            ub = np.concatenate([ub, missing])
+            order = np.argsort(ub)
+            ub, phi, status = ub[order], np.concatenate([phi, pm])[order], np.concatenate([status, sm])[order]
+        self.tables[key] = (ub, phi, status)
+        while len(self.tables) > self.keep:
+            self.tables.pop(next(iter(self.tables)))
+        i = np.searchsorted(ub, b)
+        return phi[i], status[i]
+
+    def _lookup_lut(self, b, r_obs):
+        # one table for the whole path, keyed on the physics and the first frame's r_obs
+        b_max = float(np.abs(b).max()) if b.size else 0.0
+        if self.lut is None or self.lut.b_max < b_max:
+            r_ref = r_obs if self.lut is None else self.lut.params['r_obs']
+            self.lut = geodesic_lut.get_lut(b_max, r_ref, **self.params)
+            self.integrated = self.lut.b.size
+        return self.lut.lookup(b, r_obs)
+
+
+class FrameWriter:
+    """Background PNG encoding: `put` returns immediately unless `depth` frames are already waiting."""
+
+    def __init__(self, out_dir, threads=2, depth=8):
+        self.out_dir = out_dir
+        self.queue = queue.Queue(maxsize=depth)
+        self.paths = {}
+        self.errors = []
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(threads)]
+        for t in self.threads:
+            t.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            index, img = item
+            path = os.path.join(self.out_dir, f'frame_{index:04d}.png')
+            try:
+                Image.fromarray(img, 'RGB').save(path)
+                self.paths[index] = path
+            except Exception as exc:  # reported by close(); the render loop keeps going
+                self.errors.append((index, exc))
+
+    def put(self, index, img):
+        self.queue.put((index, img))
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        if self.errors:
+            raise RuntimeError(f'failed to write {len(self.errors)} frame(s): {self.errors[0]}')
+        return [self.paths[i] for i in sorted(self.paths)]
+
+
+def _png_chunks(data):
+    """(type, body) of every chunk in the bytes of a PNG file."""
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        n, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        yield kind, data[pos + 8:pos + 8 + n]
+        pos += n + 12
+
+
+def _write_chunk(f, kind, body):
+    f.write(struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body)))
+
+
+def _rgb_png(path):
+    """Chunks of the frame at path as an 8-bit RGB PNG; FrameWriter's files are used as they are."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    chunks = list(_png_chunks(data)) if data.startswith(PNG_SIGNATURE) else []
+    if not chunks or chunks[0][0] != b'IHDR' or chunks[0][1][8:10] != b'\x08\x02':
+        with Image.open(path) as im:
+            out = io.BytesIO()
+            im.convert('RGB').save(out, 'PNG')
+        chunks = list(_png_chunks(out.getvalue()))
+    return chunks
+
+
+def save_apng(paths, out_path, fps=30):
+    """Stream frames from disk into an animated PNG, one frame (and open file) at a time.
+
+    Each frame's compressed IDAT data is copied into the APNG (as fdAT after the
+    first frame), so frames are not decoded again and memory stays at one frame.
+    """
+    delay = int(round(1000 / fps))
+    seq = 0
+    with open(out_path, 'wb') as f:
+        for index, path in enumerate(paths):
+            chunks = _rgb_png(path)
+            ihdr = chunks[0][1]
+            if index == 0:
+                first = ihdr
+                f.write(PNG_SIGNATURE)
+                _write_chunk(f, b'IHDR', ihdr)
+                _write_chunk(f, b'acTL', struct.pack('>II', len(paths), 0))  # frames, loop forever
+            elif ihdr[:8] != first[:8]:
+                raise ValueError(f'{path}: frame size {struct.unpack(">II", ihdr[:8])} differs from the first '
+                                 f'frame {struct.unpack(">II", first[:8])}')
+            # fcTL: sequence, size, offset, delay num/den (ms), dispose none, blend source
+            _write_chunk(f, b'fcTL', struct.pack('>IIIIIHHBB', seq, *struct.unpack('>II', ihdr[:8]), 0, 0,
+                                                 delay, 1000, 0, 0))
+            seq += 1
+            for kind, body in chunks:
+                if kind != b'IDAT':
+                    continue
+                if index == 0:
+                    _write_chunk(f, b'IDAT', body)
+                else:
+                    _write_chunk(f, b'fdAT', struct.pack('>I', seq) + body)
+                    seq += 1
+        _write_chunk(f, b'IEND', b'')
+
+
+def render_sequence(W, H, path, camera='pinhole', engine='batch', out_dir='frames', encoders=2,
+                    progress=True, **params):
+    """Render every frame of `path` (per-frame dicts with r_obs, b_scale, roll); returns the frame paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    cache = RadiusCache(engine, **params)
+    writer = FrameWriter(out_dir, encoders)
+    px, py = geodesic_camera.pixel_centres(W, H)
+    rays = None
+    last = None
+    t0 = time.perf_counter()
+    try:
+        for index, frame in enumerate(path):
+            r_obs, b_scale = frame['r_obs'], frame['b_scale']
+            if (r_obs, b_scale) != last:
+                b, psi, inward = geodesic_camera.camera_rays(px, py, W, H, r_obs, b_scale, camera,
+                                                             params.get('r_s', 1.0))
+                phi = np.zeros(b.shape)
+                status = np.full(b.shape, geodesic_batch.ESCAPED, dtype=np.int8)
+                phi[inward], status[inward] = cache.lookup(b[inward], r_obs)
+                rays = (phi, status, b, psi, inward)
+                last = (r_obs, b_scale)
+            phi, status, b, psi, inward = rays
+            roll = math.radians(frame.get('roll', 0.0))
+            img = geodesic_camera.shade(phi, status, b, psi + roll, inward, r_obs, camera)
+            writer.put(index, img)
+            if progress and (index % max(1, len(path)//20) == 0 or index == len(path) - 1):
+                print(f'  frame {index + 1}/{len(path)}  r_obs={r_obs:.3g} b_scale={b_scale:.3g}  '
+                      f'{cache.integrated} radii integrated  {time.perf_counter() - t0:.1f}s')
+    finally:
+        paths = writer.close()
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render a frame sequence along a parameter path')
+    parser.add_argument('--path', default=None, help='JSON path spec {"frames": N, "keys": [...], "ease": bool}')
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--r-obs', type=float, nargs='+', default=None, metavar='R',
+                        help='observer radius at the start (and end) of the path')
+    parser.add_argument('--b-scale', type=float, nargs='+', default=None, metavar='B')
+    parser.add_argument('--roll', type=float, nargs='+', default=[0.0], metavar='DEG',
+                        help='camera rotation about the line of sight, degrees')
+    parser.add_argument('--ease', action='store_true', help='smoothstep between keyframes')
+    parser.add_argument('--script', choices=sorted(geodesic_sweep.SCRIPTS), default='adaptive',
+                        help='RK4 script whose constants and PARAMS are used')
+    parser.add_argument('--width', type=int, default=400)
+    parser.add_argument('--height', type=int, default=200)
+    parser.add_argument('--camera', choices=('profile',) + geodesic_camera.CAMERAS, default='pinhole')
+    parser.add_argument('--engine', choices=geodesic_camera.ENGINES, default='batch')
+    parser.add_argument('--method', choices=geodesic_integrators.METHODS, default='rk4')
+    parser.add_argument('--out-dir', default='frames')
+    parser.add_argument('--encoders', type=int, default=2, help='PNG encoder threads')
+    parser.add_argument('--apng', default=None, help='also write the sequence as one animated PNG')
+    parser.add_argument('--fps', type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    mod = geodesic_sweep.SCRIPTS[args.script]
+    if args.path:
+        with open(args.path, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+        frames, keys, ease = spec.get('frames', args.frames), spec['keys'], spec.get('ease', args.ease)
+    else:
+        frames, ease = args.frames, args.ease
+        ends = {'r_obs': args.r_obs or [mod.r_obs], 'b_scale': args.b_scale or [mod.b_scale], 'roll': args.roll}
+        keys = [{'frame': 0, **{k: v[0] for k, v in ends.items()}},
+                {'frame': frames - 1, **{k: v[-1] for k, v in ends.items()}}]
+    # keyframes may leave a parameter out; fall back to the script's value
+    keys[0] = dict({'r_obs': mod.r_obs, 'b_scale': mod.b_scale, 'roll': 0.0}, **keys[0])
+    path = interpolate(keys, frames, ease)
+
+    params = dict(mod.PARAMS, method=args.method)
+    print(f'Sequence {frames} frames {args.width}x{args.height} camera={args.camera} engine={args.engine}')
+    paths = render_sequence(args.width, args.height, path, args.camera, args.engine, args.out_dir,
+                            args.encoders, **params)
+    print(f'Saved {len(paths)} frames to {args.out_dir}')
+    if args.apng:
+        save_apng(paths, args.apng, args.fps)
+        print(f'Saved {args.apng}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Out-of-core output for the geodesic renderers: raw per-pixel results in memory-mapped .npy files.
+
+A store is a directory holding one memory map per field, written tile by
+tile, so the frame never has to fit in RAM (a 64k x 32k render is about
+26 GB on disk):
+
+- phi.npy     float32 (H, W)    final phi of the ray (geodesic_camera.trace)
+- status.npy  int8 (H, W)       termination reason (geodesic_batch.CAPTURED, ...)
+- steps.npy   int32 (H, W)      attempted steps (batch engine; 0 for lut/elliptic)
+- colour.npy  uint8 (H, W, 3)   shaded colour
+- tiles.npy   uint8 (tiles,)    1 for finished tiles; re-running the same
+                                render resumes after an interruption
+- meta.json   sidecar: size, tile, camera, engine, r_obs, b_scale, the
+              integration parameters and the sky the colours came from; a
+              resume with anything different is refused
+- colour_1.npy, colour_2.npy... 2x2 box-filtered pyramid (`build_pyramid`)
+
+With workers > 1 tiles go to a process pool whose workers open the same
+files and write their tiles in place.  `recolour` re-shades the stored
+phi/status with another sky without integrating again, and `preview`
+returns the first pyramid level that fits a size limit; both only ever hold
+a row strip or tile of the full frame.
+
+Usage:
+    render_to_store(65536, 32768, r_obs, b_scale, 'big_render', camera='pinhole', workers=16)
+    Image.fromarray(preview('big_render', 2048)).save('big_render.png')
+    python geodesic_store.py big_render --sky milkyway_16k.png --preview big_render_sky.png
+    python geodesic_rk4.py --camera pinhole --store big_render --width 65536 --height 32768 --workers 16
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+from PIL import Image
+
+import geodesic_camera
+import geodesic_tiles
+import sky_background
+
+# bump when the file layout changes
+STORE_VERSION = 1
+# name: (dtype, trailing shape)
+FIELDS = {
+    'phi': (np.float32, ()),
+    'status': (np.int8, ()),
+    'steps': (np.int32, ()),
+    'colour': (np.uint8, (3,)),
+}
+
+# per-worker store opened by _init_worker
+_worker = {}
+
+
+class RenderStore:
+    """The memory-mapped fields and sidecar metadata of one store directory."""
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.fields = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode) for name in FIELDS}
+        self.tiles = np.load(os.path.join(path, 'tiles.npy'), mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path, meta):
+        """Open the store at path for writing, allocating it unless one with the same meta exists."""
+        meta = dict(meta, version=STORE_VERSION)
+        header = os.path.join(path, 'meta.json')
+        if os.path.exists(header):
+            with open(header, 'r', encoding='utf-8') as f:
+                old = json.load(f)
+            old.pop('pyramid', None)
+            if old != json.loads(json.dumps(meta)):
+                raise SystemExit(f'{path} holds a different render (or sky); remove it, pick another --store or re-run with the same --sky')
+            return cls(path, 'r+')
+        os.makedirs(path, exist_ok=True)
+        H, W = meta['size'][1], meta['size'][0]
+        # files start sparse and zero; nothing is touched until a tile lands
+        for name, (dtype, tail) in FIELDS.items():
+            np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), mode='w+', dtype=dtype,
+                                      shape=(H, W) + tail).flush()
+        n_tiles = len(list(geodesic_tiles.iter_tiles(W, H, meta['tile'])))
+        np.save(os.path.join(path, 'tiles.npy'), np.zeros(n_tiles, dtype=np.uint8))
+        # the sidecar goes last: a store without one was never started
+        _write_meta(path, meta)
+        return cls(path, 'r+')
+
+    @property
+    def size(self):
+        return tuple(self.meta['size'])
+
+    def write_tile(self, bounds, result):
+        x0, y0, x1, y1 = bounds
+        for name, value in result.items():
+            self.fields[name][y0:y1, x0:x1] = value
+
+    def flush(self):
+        for arr in self.fields.values():
+            arr.flush()
+        self.tiles.flush()
+
+
+def _write_meta(path, meta):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+
+def sky_id(sky):
+    """JSON description of a sky for the sidecar: source, cache key and level of a SkyMap, else its name."""
+    if isinstance(sky, sky_background.SkyMap):
+        return {'source': sky.meta['source'], 'key': os.path.basename(sky.header), 'level': sky.level}
+    return f'{getattr(sky, "__module__", "")}.{getattr(sky, "__qualname__", type(sky).__name__)}'
+
+
+def trace_tile(bounds, W, H, r_obs, b_scale, camera='pinhole', engine='batch', sky=geodesic_camera.sample_sky,
+               **params):
+    """phi, status, steps and colour of one tile, as arrays for the store."""
+    x0, y0, x1, y1 = bounds
+    px, py = geodesic_camera.pixel_centres(W, H, x0, y0, x1, y1)
+    ray_stats = {}
+    traced = geodesic_camera.trace(px, py, W, H, r_obs, b_scale, camera, engine, ray_stats=ray_stats, **params)
+    phi, status = traced[0], traced[1]
+    steps = ray_stats.get('steps', np.zeros(phi.shape, dtype=np.int64))
+    return {'phi': phi, 'status': status, 'steps': np.minimum(steps, np.iinfo(np.int32).max),
+            'colour': geodesic_camera.shade(*traced, r_obs, camera, sky)}
+
+
+def _init_worker(path, render_kwargs):
+    _worker['store'] = RenderStore(path, 'r+')
+    _worker['kwargs'] = render_kwargs
+
+
+def _run_tile(job):
+    t0 = time.perf_counter()
+    index, bounds = job
+    store = _worker['store']
+    W, H = store.size
+    store.write_tile(bounds, trace_tile(bounds, W, H, **_worker['kwargs']))
+    return index, bounds, time.perf_counter() - t0
+
+
+def render_to_store(W, H, r_obs, b_scale, path, camera='pinhole', engine='batch', workers=1, tile=256,
+                    sky=geodesic_camera.sample_sky, progress=True, **params):
+    """Render into the store at path tile by tile, skipping tiles an earlier run finished; returns the store."""
+    meta = {'size': [W, H], 'tile': tile, 'camera': camera, 'engine': engine, 'r_obs': r_obs,
+            'b_scale': b_scale, 'params': {k: v for k, v in params.items() if k != 'cache_dir'},
+            'sky': sky_id(sky)}
+    store = RenderStore.create(path, meta)
+    tiles = list(geodesic_tiles.iter_tiles(W, H, tile))
+    todo = [(i, bounds) for i, bounds in enumerate(tiles) if not store.tiles[i]]
+    if progress and len(todo) < len(tiles):
+        print(f'  resuming {path}: {len(tiles) - len(todo)}/{len(tiles)} tiles already done')
+    # the colour pyramid no longer matches once a tile changes
+    store.meta.pop('pyramid', None)
+    _write_meta(path, store.meta)
+    geodesic_tiles.prepare(W, H, r_obs, b_scale, camera, engine, **dict(params))
+    kwargs = dict(params, r_obs=r_obs, b_scale=b_scale, camera=camera, engine=engine, sky=sky)
+
+    t0 = time.perf_counter()
+
+    def finished(done, index, bounds, elapsed):
+        # marked by this process only, after the tile's pixels are in the maps
+        store.tiles[index] = 1
+        if progress and (done % max(1, len(todo) // 10) == 0 or done == len(todo)):
+            print(f'  tiles {done}/{len(todo)}  last {bounds} {elapsed:.2f}s  total {time.perf_counter() - t0:.1f}s')
+
+    if workers > 1:
+        with mp.Pool(workers, initializer=_init_worker, initargs=(path, kwargs)) as pool:
+            for done, result in enumerate(pool.imap_unordered(_run_tile, todo, chunksize=1), 1):
+                finished(done, *result)
+    else:
+        for done, (index, bounds) in enumerate(todo, 1):
+            t1 = time.perf_counter()
+            store.write_tile(bounds, trace_tile(bounds, W, H, **kwargs))
+            finished(done, index, bounds, time.perf_counter() - t1)
+    store.flush()
+    return RenderStore(path, 'r+')
+
+
+def recolour(path, sky=geodesic_camera.sample_sky, rows=64):
+    """Re-shade the stored phi/status with another sky, `rows` image rows at a time."""
+    store = RenderStore(path, 'r+')
+    if not store.tiles.all():
+        raise SystemExit(f'{path} is not finished; re-run the render to complete it first')
+    W, H = store.size
+    meta = store.meta
+    phi, status, colour = store.fields['phi'], store.fields['status'], store.fields['colour']
+    r_s = meta['params'].get('r_s', 1.0)
+    for y0 in range(0, H, rows):
+        y1 = min(y0 + rows, H)
+        px, py = geodesic_camera.pixel_centres(W, H, 0, y0, W, y1)
+        b, psi, inward = geodesic_camera.camera_rays(px, py, W, H, meta['r_obs'], meta['b_scale'],
+                                                     meta['camera'], r_s)
+        colour[y0:y1] = geodesic_camera.shade(phi[y0:y1].astype(np.float64), status[y0:y1], b, psi, inward,
+                                              meta['r_obs'], meta['camera'], sky)
+    colour.flush()
+    meta['sky'] = sky_id(sky)
+    meta.pop('pyramid', None)
+    _write_meta(path, meta)
+
+
+def build_pyramid(path, min_size=256, rows=512):
+    """Halve colour.npy into colour_1.npy, colour_2.npy... until the longest side is at most min_size.
+
+    Levels the sidecar already lists are kept; only the missing smaller ones are written.
+    """
+    store = RenderStore(path)
+    names = list(store.meta.get('pyramid', []))
+    level = np.load(os.path.join(path, names[-1]), mmap_mode='r') if names else store.fields['colour']
+    while max(level.shape[:2]) > min_size and min(level.shape[:2]) >= 2:
+        names.append(f'colour_{len(names) + 1}.npy')
+        level = sky_background.downsample_half(level, os.path.join(path, names[-1]), rows)
+    store.meta['pyramid'] = names
+    _write_meta(path, store.meta)
+    return names
+
+
+def preview(path, max_size=2048, min_size=256):
+    """(h, w, 3) uint8 colour of the finest pyramid level no larger than max_size, building levels as needed."""
+    store = RenderStore(path)
+    names = build_pyramid(path, min(min_size, max_size))
+    level = store.fields['colour']
+    for name in names:
+        if max(level.shape[:2]) <= max_size:
+            break
+        level = np.load(os.path.join(path, name), mmap_mode='r')
+    return np.array(level)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Re-colour a render store and write a PNG preview')
+    parser.add_argument('store', help='store directory written by render_to_store / --store')
+    parser.add_argument('--sky', metavar='IMAGE', default=None,
+                        help='re-shade with this equirectangular sky (default: keep the stored colours)')
+    parser.add_argument('--sky-level', type=int, default=0)
+    parser.add_argument('--preview', default=None, help='preview PNG (default: <store>.png)')
+    parser.add_argument('--max-size', type=int, default=2048, help='longest preview side')
+    args = parser.parse_args(argv)
+
+    if args.sky:
+        t0 = time.perf_counter()
+        recolour(args.store, sky_background.SkyMap.open(args.sky, level=args.sky_level))
+        print(f'Re-coloured {args.store} in {time.perf_counter() - t0:.1f}s')
+    out = args.preview or args.store.rstrip('/\\') + '.png'
+    Image.fromarray(preview(args.store, args.max_size), 'RGB').save(out)
+    print('Saved', out)
+
+
+if __name__ == '__main__':
+    main()
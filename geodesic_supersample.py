@@ -0,0 +1,73 @@
+"""Edge-aware adaptive supersampling for the geodesic renderers.
+
+One ray per pixel centre aliases at the capture boundary, where phi diverges,
+while the far field is smooth.  `render_supersampled` traces the pixel
+centres, marks pixels whose 3x3 neighbourhood disagrees in capture status or
+spans more than `phi_threshold` radians of phi, and replaces only those
+pixels by the mean of n x n stratified subsamples.  Around the shadow and
+photon ring this matches uniform n*n supersampling while tracing a small
+fraction of its rays.
+
+By default each subsample sits at the centre of its stratum.  The pattern is
+then the same in every pixel and mirror-symmetric about the image centre, so
+`geodesic_camera.integrate_unique` still shares radii between pixels;
+jitter=True randomises within each stratum instead (seeded) at the cost of
+one integration per subsample.
+"""
+import numpy as np
+
+import geodesic_batch
+import geodesic_camera
+
+
+def _neighbour_range(a):
+    """max - min over each pixel's 3x3 neighbourhood (edges replicated)."""
+    H, W = a.shape
+    pad = np.pad(a, 1, mode='edge')
+    windows = [pad[dy:dy + H, dx:dx + W] for dy in range(3) for dx in range(3)]
+    return np.maximum.reduce(windows) - np.minimum.reduce(windows)
+
+
+def edge_mask(phi, status, phi_threshold=0.1):
+    """Pixels next to a capture-status change or a phi jump above phi_threshold."""
+    captured = (status == geodesic_batch.CAPTURED).astype(np.int8)
+    # captured rays stop at the horizon, so their phi is not comparable with their neighbours'
+    phi = np.where(captured, np.nan, phi)
+    with np.errstate(invalid='ignore'):
+        jump = np.nan_to_num(_neighbour_range(phi), nan=0.0) > phi_threshold
+    return (_neighbour_range(captured) > 0) | jump
+
+
+def stratified_offsets(n, count, rng=None):
+    """(count, n*n) x and y offsets in [0, 1), one per cell of an n x n grid; jittered if rng is given."""
+    gx = np.broadcast_to(np.arange(n*n) % n, (count, n*n))
+    gy = np.broadcast_to(np.arange(n*n) // n, (count, n*n))
+    if rng is None:
+        return (gx + 0.5) / n, (gy + 0.5) / n
+    return (gx + rng.random((count, n*n))) / n, (gy + rng.random((count, n*n))) / n
+
+
+def render_supersampled(W, H, r_obs, b_scale, camera='pinhole', engine='batch', samples=4,
+                        phi_threshold=0.1, jitter=False, seed=0, chunk=1 << 18, counts=None, **params):
+    """Render with samples x samples stratified rays on edge pixels only; returns a (H, W, 3) uint8 image.
+
+    If `counts` is a dict it receives 'edge_pixels' and 'rays' (centre rays plus subsamples).
+    """
+    px, py = geodesic_camera.pixel_centres(W, H)
+    traced = geodesic_camera.trace(px, py, W, H, r_obs, b_scale, camera, engine, **params)
+    img = geodesic_camera.shade(*traced, r_obs, camera)
+    iy, ix = np.nonzero(edge_mask(traced[0], traced[1], phi_threshold))
+    rng = np.random.default_rng(seed) if jitter else None
+    m = samples * samples
+    # whole pixels per chunk so each chunk's subsamples can be averaged directly
+    per_chunk = max(1, chunk // m)
+    for s in range(0, ix.size, per_chunk):
+        cx, cy = ix[s:s + per_chunk], iy[s:s + per_chunk]
+        ox, oy = stratified_offsets(samples, cx.size, rng)
+        sub = geodesic_camera.render_pixels(cx[:, None] + ox, cy[:, None] + oy, W, H, r_obs, b_scale,
+                                            camera, engine, **params)
+        img[cy, cx] = np.rint(sub.astype(np.float64).mean(axis=1)).astype(np.uint8)
+    if counts is not None:
+        counts['edge_pixels'] = int(ix.size)
+        counts['rays'] = W*H + int(ix.size) * m
+    return img
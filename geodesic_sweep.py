@@ -0,0 +1,215 @@
+"""Parameter sweeps over the geodesic renderers with a job manifest and shared integration.
+
+A sweep spec (JSON, or YAML when PyYAML is installed) lists jobs as a base
+configuration, a grid of values whose Cartesian product is swept, and/or
+explicit job entries:
+
+    {
+      "output_dir": "sweep_out",
+      "base": {"script": "adaptive", "camera": "pinhole", "engine": "batch"},
+      "grid": {"r_obs": [50, 100], "b_scale": [4, 6, 8], "tol": [1e-3, 1e-4],
+               "resolution": ["200x100", "400x200"]},
+      "jobs": [{"r_obs": 30, "method": "binet"}]
+    }
+
+A job starts from one RK4 script's constants (W, H, r_obs, b_scale, PARAMS;
+default 'adaptive') and any key that is not a render setting (script,
+resolution, width, height, r_obs, b_scale, camera, engine, name) overrides
+an integrator parameter.
+
+phi(b) depends only on the engine, r_obs and the integrator parameters, so
+jobs are grouped by that physics key.  Each group integrates the union of
+its jobs' unique impact parameters once and every job is shaded from it;
+with the batch and elliptic engines images are identical to separate
+renders and b_scale, resolution and camera variations cost only their new
+radii; with engine 'lut' a group builds one refined phi(b) table up to its
+largest radius and every job is a lookup.  Groups run on a process pool.
+`manifest.json` in the output directory records every finished job (output,
+parameters, timings) and those jobs are skipped on the next run.
+
+Usage:
+    python geodesic_sweep.py sweep.json [--workers 4] [--force]
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+
+import geodesic_batch
+import geodesic_camera
+import geodesic_rk4
+import geodesic_rk4_adaptive
+import geodesic_rk4_medium
+import geodesic_rk4_quick
+
+SCRIPTS = {
+    'rk4': geodesic_rk4,
+    'adaptive': geodesic_rk4_adaptive,
+    'medium': geodesic_rk4_medium,
+    'quick': geodesic_rk4_quick,
+}
+RENDER_KEYS = ('script', 'resolution', 'width', 'height', 'r_obs', 'b_scale', 'camera', 'engine', 'name')
+MANIFEST = 'manifest.json'
+
+
+def load_spec(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit('YAML sweep specs need PyYAML (pip install pyyaml); or use JSON')
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def expand(spec):
+    """The spec's job dicts: base + every grid combination, then base + each explicit job."""
+    base = spec.get('base', {})
+    grid = spec.get('grid', {})
+    jobs = []
+    if grid or not spec.get('jobs'):
+        keys = list(grid)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            jobs.append(dict(base, **dict(zip(keys, values))))
+    jobs += [dict(base, **job) for job in spec.get('jobs', [])]
+    return [resolve(job) for job in jobs]
+
+
+def resolve(job):
+    """Fill a job from its script's constants; returns {'render': {...}, 'params': {...}, 'id', 'output'}."""
+    mod = SCRIPTS[job.get('script', 'adaptive')]
+    # geodesic_rk4_adaptive.py takes its size from --width/--height (default 800x400)
+    W, H = getattr(mod, 'W', 800), getattr(mod, 'H', 400)
+    if 'resolution' in job:
+        W, H = (int(v) for v in str(job['resolution']).lower().split('x'))
+    render = {
+        'script': job.get('script', 'adaptive'),
+        'width': int(job.get('width', W)), 'height': int(job.get('height', H)),
+        'r_obs': float(job.get('r_obs', mod.r_obs)), 'b_scale': float(job.get('b_scale', mod.b_scale)),
+        'camera': job.get('camera', 'pinhole'), 'engine': job.get('engine', 'batch'),
+    }
+    params = dict(mod.PARAMS, **{k: v for k, v in job.items() if k not in RENDER_KEYS})
+    blob = json.dumps({'render': render, 'params': params}, sort_keys=True, default=float)
+    job_id = hashlib.sha1(blob.encode('utf-8')).hexdigest()[:12]
+    name = job.get('name', f"{render['script']}_{render['camera']}_{render['width']}x{render['height']}")
+    return {'id': job_id, 'render': render, 'params': params, 'output': f'{name}_{job_id}.png'}
+
+
+def physics_key(job):
+    """Jobs with equal keys get identical phi(b) and can share integrations."""
+    render = job['render']
+    return json.dumps({'engine': render['engine'], 'r_obs': render['r_obs'], 'params': job['params']},
+                      sort_keys=True, default=float)
+
+
+def job_rays(job):
+    render = job['render']
+    W, H = render['width'], render['height']
+    return geodesic_camera.camera_rays(*geodesic_camera.pixel_centres(W, H), W, H, render['r_obs'],
+                                       render['b_scale'], render['camera'], job['params'].get('r_s', 1.0))
+
+
+def run_group(args):
+    """Integrate the union of a group's radii once and render, save and describe each of its jobs."""
+    jobs, output_dir = args
+    first = jobs[0]
+    r_obs, engine, params = first['render']['r_obs'], first['render']['engine'], first['params']
+    t0 = time.perf_counter()
+    rays = [job_rays(job) for job in jobs]
+    needed = [np.unique(b[inward]) for b, _, inward in rays]
+    union = np.unique(np.concatenate(needed))
+    phi_u, status_u = geodesic_camera.integrate_unique(union, r_obs, engine=engine, **params)
+    t_integrate = time.perf_counter() - t0
+
+    entries = []
+    for job, (b, psi, inward), own in zip(jobs, rays, needed):
+        t1 = time.perf_counter()
+        phi = np.zeros(b.shape)
+        status = np.full(b.shape, geodesic_batch.ESCAPED, dtype=np.int8)
+        i = np.searchsorted(union, b[inward])
+        phi[inward], status[inward] = phi_u[i], status_u[i]
+        img = geodesic_camera.shade(phi, status, b, psi, inward, r_obs, job['render']['camera'])
+        path = os.path.join(output_dir, job['output'])
+        geodesic_batch.save_png(img, path)
+        entries.append({
+            'id': job['id'], 'output': job['output'], 'render': job['render'], 'params': job['params'],
+            'unique_rays': int(own.size), 'group_rays': int(union.size), 'group_jobs': len(jobs),
+            # each job is charged its share of the group's integration
+            'seconds': t_integrate * own.size / max(sum(n.size for n in needed), 1) + time.perf_counter() - t1,
+        })
+    return entries
+
+
+def read_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {e['id']: e for e in json.load(f)['jobs']}
+
+
+def write_manifest(output_dir, entries):
+    path = os.path.join(output_dir, MANIFEST)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'jobs': sorted(entries.values(), key=lambda e: e['output'])}, f, indent=1)
+    os.replace(tmp, path)
+
+
+def run_sweep(spec, output_dir=None, workers=1, force=False, progress=True):
+    """Run every job of a spec not already in the manifest; returns the manifest entries by job id."""
+    output_dir = output_dir or spec.get('output_dir', 'sweep_out')
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {} if force else read_manifest(output_dir)
+    jobs = {job['id']: job for job in expand(spec)}
+    todo = [job for job in jobs.values() if job['id'] not in manifest
+            or not os.path.exists(os.path.join(output_dir, manifest[job['id']]['output']))]
+    groups = {}
+    for job in todo:
+        groups.setdefault(physics_key(job), []).append(job)
+    if progress:
+        print(f'Sweep: {len(jobs)} jobs, {len(jobs) - len(todo)} already done, '
+              f'{len(todo)} to render in {len(groups)} physics group(s)')
+    tasks = [(group, output_dir) for group in groups.values()]
+    t0 = time.perf_counter()
+    if workers > 1 and len(tasks) > 1:
+        pool = mp.Pool(min(workers, len(tasks)))
+        results = pool.imap_unordered(run_group, tasks)
+    else:
+        pool = None
+        results = map(run_group, tasks)
+    try:
+        for entries in results:
+            for entry in entries:
+                manifest[entry['id']] = entry
+            # rewritten after every group so an interrupted sweep resumes where it stopped
+            write_manifest(output_dir, manifest)
+            if progress:
+                e = entries[0]
+                print(f"  group r_obs={e['render']['r_obs']:g}: {len(entries)} job(s), "
+                      f"{e['group_rays']} unique radii for {sum(x['unique_rays'] for x in entries)} requested  "
+                      f"{time.perf_counter() - t0:.1f}s")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parameter sweep over the geodesic renderers')
+    parser.add_argument('spec', help='sweep spec, JSON or YAML')
+    parser.add_argument('--out', default=None, help='output directory (default: spec output_dir or sweep_out)')
+    parser.add_argument('--workers', type=int, default=1, help='physics groups rendered in parallel')
+    parser.add_argument('--force', action='store_true', help='ignore the manifest and render every job')
+    args = parser.parse_args(argv)
+    run_sweep(load_spec(args.spec), args.out, args.workers, args.force)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Multi-process tile renderer with a shared-memory framebuffer.
+
+The image is cut into tiles that are handed to a process pool one at a time
+(imap_unordered with chunksize 1), so a worker that lands on the expensive
+photon-sphere region does not hold up the rest: idle workers keep pulling
+tiles.  Workers attach to one `multiprocessing.shared_memory` RGB buffer and
+write their tile in place; nothing but tile bounds and timings crosses the
+process boundary, and the PNG is encoded once by the parent at the end.
+"""
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image
+
+import geodesic_camera
+import geodesic_lut
+
+# per-worker state set by _init_worker
+_worker = {}
+
+
+def iter_tiles(W, H, tile=64):
+    """Tile bounds (x0, y0, x1, y1) covering a W x H image in row-major order."""
+    for y0 in range(0, H, tile):
+        for x0 in range(0, W, tile):
+            yield x0, y0, min(x0 + tile, W), min(y0 + tile, H)
+
+
+def render_tile(bounds, W, H, r_obs, b_scale, camera='pinhole', engine='batch', **params):
+    """Colours for one tile, shape (y1 - y0, x1 - x0, 3)."""
+    x0, y0, x1, y1 = bounds
+    px, py = geodesic_camera.pixel_centres(W, H, x0, y0, x1, y1)
+    return geodesic_camera.render_pixels(px, py, W, H, r_obs, b_scale, camera, engine, **params)
+
+
+def _init_worker(shm_name, W, H, render_kwargs):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm  # keep the mapping alive for the life of the worker
+    _worker['buf'] = np.ndarray((H, W, 3), dtype=np.uint8, buffer=shm.buf)
+    _worker['W'], _worker['H'] = W, H
+    _worker['kwargs'] = render_kwargs
+
+
+def _run_tile(bounds):
+    t0 = time.perf_counter()
+    x0, y0, x1, y1 = bounds
+    _worker['buf'][y0:y1, x0:x1] = render_tile(bounds, _worker['W'], _worker['H'], **_worker['kwargs'])
+    return bounds, time.perf_counter() - t0
+
+
+def prepare(W, H, r_obs, b_scale, camera='pinhole', engine='batch', **params):
+    """Work that must happen once before workers start (building a shared LUT)."""
+    if engine == 'lut':
+        b, _, inward = geodesic_camera.camera_rays(*geodesic_camera.pixel_centres(W, H), W, H,
+                                                   r_obs, b_scale, camera, params.get('r_s', 1.0))
+        cache_dir = params.pop('cache_dir', geodesic_lut.CACHE_DIR)
+        params.pop('sky', None)
+        geodesic_lut.get_lut(float(b[inward].max()), r_obs, cache_dir=cache_dir, **params)
+
+
+def render_parallel(W, H, r_obs, b_scale, camera='pinhole', engine='batch', workers=None,
+                    tile=64, progress=True, out_path=None, **params):
+    """Render on a process pool; returns a (H, W, 3) uint8 array (a copy of the shared buffer).
+
+    With out_path the PNG is encoded straight from the shared buffer and None is returned.
+    """
+    workers = workers or mp.cpu_count()
+    prepare(W, H, r_obs, b_scale, camera, engine, **dict(params))
+    tiles = list(iter_tiles(W, H, tile))
+    kwargs = dict(params, r_obs=r_obs, b_scale=b_scale, camera=camera, engine=engine)
+    shm = shared_memory.SharedMemory(create=True, size=W * H * 3)
+    try:
+        with mp.Pool(workers, initializer=_init_worker, initargs=(shm.name, W, H, kwargs)) as pool:
+            t0 = time.perf_counter()
+            for done, (bounds, elapsed) in enumerate(pool.imap_unordered(_run_tile, tiles, chunksize=1), 1):
+                if progress and (done % max(1, len(tiles)//10) == 0 or done == len(tiles)):
+                    print(f'  tiles {done}/{len(tiles)}  last {bounds} {elapsed:.2f}s  '
+                          f'total {time.perf_counter() - t0:.1f}s')
+        frame = np.ndarray((H, W, 3), dtype=np.uint8, buffer=shm.buf)
+        result = None
+        if out_path is not None:
+            Image.fromarray(frame, 'RGB').save(out_path)
+        else:
+            result = frame.copy()
+        del frame  # drop the view so the shared block can be closed
+        return result
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,143 @@
+"""Incrementally updated deflection field for the interactive thin-lens demo (main.py).
+
+Summing the deflection of every lens at every pixel costs O(pixels x
+lenses) per frame.  `DeflectionField` keeps the total deflection in an rg32f
+texture instead:
+
+- a full pass (shaders/lensing.comp: shared-memory tiled sum with the
+  optional per-tile far field) fills it from the static field and the
+  editable lenses
+- when editable lenses move, change Re, or are added or removed, only the
+  difference is summed: the old versions of the changed lenses with
+  sign -1 and their new versions with sign +1, accumulated onto the field,
+  so an edit costs O(pixels x changed lenses) whatever the lens count
+- shaders/lens_compose.comp then does the background lookup from the
+  field, which is also all a background-scale change needs
+
+Each incremental pass adds float32 rounding, so the field is rebuilt from
+scratch every `rebuild_every` edits.  Edits are summed exactly; with
+far_theta > 0 the field therefore drifts towards the exact sum for edited
+lenses between rebuilds, which only moves it closer to the far_theta = 0
+sum.
+
+Usage:
+    field = DeflectionField(ctx, (W, H), static_lenses, far_theta)
+    ...after every lens edit:
+    field.update(lenses)                 # (n, >=3) x, y, Re of the editable lenses
+    field.compose(tex, background, bg_scale)
+"""
+import os
+import numpy as np
+
+DIR = os.path.dirname(__file__)
+FIELD_SHADER = os.path.join(DIR, 'shaders', 'lensing.comp')
+COMPOSE_SHADER = os.path.join(DIR, 'shaders', 'lens_compose.comp')
+LENS_BYTES = 16  # one vec4 (x, y, Re, pad) per lens in the shaders' LensBuffer
+REBUILD_EVERY = 1000
+
+
+def _load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _pack(lenses):
+    """(n, 4) float32 LensBuffer entries from (n, >=3) x, y, Re."""
+    lenses = np.asarray(lenses, dtype='f4')
+    out = np.zeros((len(lenses), 4), dtype='f4')
+    if len(lenses):
+        out[:, :3] = lenses[:, :3]
+    return out
+
+
+class DeflectionField:
+    """Total deflection of a static lens field plus editable lenses, kept in an rg32f texture of `size`."""
+
+    def __init__(self, ctx, size, field=None, far_theta=0.0, rebuild_every=REBUILD_EVERY):
+        self.ctx = ctx
+        self.size = tuple(size)
+        self.far_theta = far_theta
+        self.rebuild_every = rebuild_every
+        self.field_prog = ctx.compute_shader(_load(FIELD_SHADER))
+        self.compose_prog = ctx.compute_shader(_load(COMPOSE_SHADER))
+        self.tex = ctx.texture(self.size, 2, dtype='f4')
+        # LensBuffer: the static field first, uploaded once, then the editable lenses
+        self.field = _pack(np.zeros((0, 3)) if field is None else field)
+        self.ssbo = ctx.buffer(reserve=(len(self.field) + 8) * LENS_BYTES)
+        if len(self.field):
+            self.ssbo.write(self.field)
+        # old and new versions of the lenses changed by one edit
+        self.delta = ctx.buffer(reserve=16 * LENS_BYTES)
+        # LensBlock uniform buffer, one write per pass
+        self.params = np.zeros(8, dtype='f4')
+        self.ubo = ctx.buffer(reserve=self.params.nbytes)
+        self.lenses = None  # editable lenses the texture currently holds; None: needs a full pass
+        self.edits = 0
+
+    def invalidate(self):
+        """Force a full pass on the next update."""
+        self.lenses = None
+
+    def _sum(self, buf, first, count, sign, far_theta, accumulate):
+        buf.bind_to_storage_buffer(1)
+        self.tex.bind_to_image(0, read=accumulate, write=True)
+        # LensBlock (std140): int u_lens_count, float u_far_theta, int u_first, float u_sign, int u_accumulate
+        ints = self.params.view(np.int32)
+        ints[0] = count
+        self.params[1] = far_theta
+        ints[2] = first
+        self.params[3] = sign
+        ints[4] = int(accumulate)
+        self.ubo.write(self.params)
+        self.ubo.bind_to_uniform_block(0)
+        self.field_prog.run(group_x=(self.size[0] + 7) // 8, group_y=(self.size[1] + 7) // 8, group_z=1)
+        self.ctx.memory_barrier()
+
+    def update(self, lenses):
+        """Bring the field up to date with the editable lenses (n, >=3); returns the number of lenses summed."""
+        lenses = _pack(lenses)
+        n_field, n = len(self.field), len(lenses)
+        count = n_field + n
+        if count * LENS_BYTES > self.ssbo.size:
+            # grow geometrically; orphaning drops the contents, so the field goes up again
+            self.ssbo.orphan(max(count * LENS_BYTES, 2 * self.ssbo.size))
+            if n_field:
+                self.ssbo.write(self.field)
+        if n:
+            self.ssbo.write(lenses, offset=n_field * LENS_BYTES)
+
+        old = self.lenses
+        if old is not None and self.edits < self.rebuild_every:
+            common = min(len(old), n)
+            changed = np.flatnonzero(np.any(old[:common] != lenses[:common], axis=1))
+            removed = np.concatenate([old[changed], old[common:]])
+            added = np.concatenate([lenses[changed], lenses[common:]])
+            k = len(removed) + len(added)
+            if k == 0:
+                return 0
+            if k < count:
+                if k * LENS_BYTES > self.delta.size:
+                    self.delta.orphan(2 * k * LENS_BYTES)
+                self.delta.write(np.concatenate([removed, added]))
+                # edits are summed exactly: a single lens gains nothing from the far field
+                if len(removed):
+                    self._sum(self.delta, 0, len(removed), -1.0, 0.0, True)
+                if len(added):
+                    self._sum(self.delta, len(removed), len(added), 1.0, 0.0, True)
+                self.lenses = lenses
+                self.edits += 1
+                return k
+
+        self._sum(self.ssbo, 0, count, 1.0, self.far_theta, False)
+        self.lenses = lenses
+        self.edits = 0
+        return count
+
+    def compose(self, dest, background, bg_scale=1.0):
+        """Write the lensed background into the rgba32f texture `dest` (same size as the field)."""
+        dest.bind_to_image(0, read=False, write=True)
+        self.tex.bind_to_image(1, read=True, write=False)
+        background.use(location=0)
+        self.compose_prog['u_bg_scale'] = bg_scale
+        self.compose_prog.run(group_x=(self.size[0] + 7) // 8, group_y=(self.size[1] + 7) // 8, group_z=1)
+        self.ctx.memory_barrier()
@@ -0,0 +1,122 @@
+"""NumPy implementation of the multi-lens thin-lens render of main.py (shaders/lensing.comp + lens_compose.comp).
+
+Same lens model (point masses, deflection Re^2 d / (|d|^2 + 1e-8) in
+normalized screen coordinates) and the same background lookup (source
+position times bg_scale, wrapped, sampled bilinearly with repeat at the base
+mip level, which is what texture() does in a compute shader).  No GL context
+is needed, so frames render on batch machines without a display and GPU
+output can be checked against it.
+
+The deflection sum runs over blocks of pixels x lenses holding at most
+`chunk` pairs, so memory stays bounded for large images and lens fields.
+Arrays use the texture's row order (row 0 is the bottom of the window);
+`render` output compares directly with the GPU texture read back as floats.
+
+Usage:
+    python lensing_cpu.py --lenses 10000 --out lensing_cpu.png
+    python lensing_cpu.py --background sky.png --bg-scale 2 --width 1600 --height 1200
+"""
+import argparse
+import time
+import numpy as np
+from PIL import Image
+
+import sky_background
+
+# the two lenses main.py starts with: x, y, Re (normalized screen units)
+DEFAULT_LENSES = ((0.45, 0.5, 0.06), (0.55, 0.5, 0.06))
+
+
+def star_field(n, re=0.002, seed=0):
+    """n point lenses of Einstein radius re at uniform random screen positions, packed as LensBuffer vec4s."""
+    rng = np.random.default_rng(seed)
+    lenses = np.zeros((n, 4), dtype='f4')
+    lenses[:, :2] = rng.random((n, 2))
+    lenses[:, 2] = re
+    return lenses
+
+
+def starfield_background(size=(1024, 512), stars=8000, seed=0):
+    """(H, W, 3) float32 version of main.py's seeded starfield (sky_background.starfield)."""
+    return sky_background.starfield(size, stars, seed).astype(np.float32) / 255
+
+
+def deflection(uv, lenses, chunk=1 << 22):
+    """Total deflection (P, 2) at points uv (P, 2) from lenses (N, >=3: x, y, Re)."""
+    uv = np.asarray(uv, dtype=np.float32)
+    lenses = np.asarray(lenses, dtype=np.float32)
+    total = np.zeros(uv.shape, dtype=np.float32)
+    n = len(lenses)
+    if n == 0:
+        return total
+    per_lens = min(n, chunk)
+    per_pixel = max(1, chunk // per_lens)
+    for p in range(0, len(uv), per_pixel):
+        x = uv[p:p + per_pixel, None, :]
+        for l in range(0, n, per_lens):
+            lens = lenses[l:l + per_lens]
+            d = x - lens[None, :, :2]
+            r2 = np.einsum('pnk,pnk->pn', d, d) + np.float32(1e-8)
+            w = lens[None, :, 2]**2 / r2
+            total[p:p + per_pixel] += np.einsum('pn,pnk->pk', w, d)
+    return total
+
+
+def sample_bilinear(image, uv):
+    """Bilinear lookup of image (h, w, C) at texture coordinates uv (..., 2) with repeat wrapping."""
+    h, w = image.shape[:2]
+    x = uv[..., 0] * w - 0.5
+    y = uv[..., 1] * h - 0.5
+    x0, y0 = np.floor(x), np.floor(y)
+    fx, fy = (x - x0)[..., None], (y - y0)[..., None]
+    x0, y0 = x0.astype(np.int64) % w, y0.astype(np.int64) % h
+    x1, y1 = (x0 + 1) % w, (y0 + 1) % h
+    top = image[y0, x0] * (1 - fx) + image[y0, x1] * fx
+    bottom = image[y1, x0] * (1 - fx) + image[y1, x1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def render(W, H, lenses, background, bg_scale=1.0, chunk=1 << 22):
+    """(H, W, 3) float32 frame in texture row order, as lens_compose.comp writes it."""
+    py, px = np.mgrid[0:H, 0:W].astype(np.float32)
+    uv = np.stack([(px + 0.5) / W, (py + 0.5) / H], axis=-1).reshape(-1, 2)
+    src = uv - deflection(uv, lenses, chunk)
+    bg_uv = np.mod(src * np.float32(bg_scale), 1.0)
+    return sample_bilinear(background, bg_uv).reshape(H, W, -1).astype(np.float32)
+
+
+def to_image(frame):
+    """8-bit RGB image of a render, flipped to window orientation (what main.py's screenshots show)."""
+    return Image.fromarray(np.rint(np.clip(frame[::-1], 0.0, 1.0) * 255).astype(np.uint8), 'RGB')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless NumPy thin-lens renderer (matches the main.py compute shaders)')
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=600)
+    parser.add_argument('--lenses', type=int, default=0, help='add a random field of N point lenses')
+    parser.add_argument('--lens-re', type=float, default=0.002, help='Einstein radius of the field lenses')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--background', default=None, help='background image (default: seeded starfield)')
+    parser.add_argument('--bg-scale', type=float, default=1.0)
+    parser.add_argument('--chunk', type=int, default=1 << 22, help='pixel x lens pairs per block')
+    parser.add_argument('--out', default='lensing_cpu.png')
+    args = parser.parse_args(argv)
+
+    lenses = np.zeros((len(DEFAULT_LENSES), 4), dtype='f4')
+    lenses[:, :3] = DEFAULT_LENSES
+    if args.lenses:
+        lenses = np.concatenate([star_field(args.lenses, args.lens_re, args.seed), lenses])
+    if args.background:
+        background = np.asarray(Image.open(args.background).convert('RGB'), dtype=np.float32) / 255
+    else:
+        background = starfield_background(seed=args.seed)
+    t0 = time.perf_counter()
+    frame = render(args.width, args.height, lenses, background, args.bg_scale, args.chunk)
+    print(f'Rendered {args.width}x{args.height} with {len(lenses)} lenses in {time.perf_counter() - t0:.2f}s')
+    to_image(frame).save(args.out)
+    print('Saved', args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""Barnes-Hut / multipole deflection for large point-lens populations.
+
+Direct summation (lensing_cpu.deflection, shaders/lensing.comp) costs
+O(points x lenses).  `LensTree` builds a quadtree over the lenses in lens-plane
+(normalized screen) coordinates and evaluates the deflection in roughly
+O(points log lenses).
+
+In complex notation the point-mass deflection at z is
+alpha(z) = conj(f(z)) with f(z) = sum_k m_k / (z - z_k), m_k = Re_k^2.  Every
+node stores the multipole coefficients a_p = sum_k m_k (z_k - c)^p,
+p = 0..order, about its centre of mass c, so that outside the node
+f(z) ~ sum_p a_p / (z - c)^(p+1).
+
+Points are evaluated in batches of nearby points (Morton order) and the
+tree is walked once per batch, level by level, all batches at once:
+
+- a node whose lenses all lie within r of c, and that is at distance
+  d >= r / theta from the batch's bounding box, is evaluated from its
+  expansion; the truncation error of that node is at most
+  (M / d) * theta^(order+1) / (1 - theta), M being its total mass
+- a leaf that is not that far is summed directly, with the shader's
+  1e-8 softening
+- any other node is opened and its children are tested at the next level
+
+theta = 0 opens every node, which is the direct sum.
+
+Usage:
+    tree = LensTree(lenses)              # (N, >=3) x, y, Re
+    alpha = tree.deflection(uv, theta=0.5)
+    python lensing_tree.py --lenses 1000000 --theta 0.5 --out crowded.png
+"""
+import argparse
+import time
+import numpy as np
+from PIL import Image
+
+import lensing_cpu
+
+MORTON_BITS = 16
+
+
+def _spread_bits(v):
+    """Insert a zero bit between each of the low 16 bits of v (uint64)."""
+    v = v & 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+
+def morton_codes(xy, lo, size, bits=MORTON_BITS):
+    """Interleaved quadtree cell codes of points xy (N, 2) inside the square [lo, lo + size)."""
+    q = np.clip(((xy - lo) / size * (1 << bits)).astype(np.int64), 0, (1 << bits) - 1).astype(np.uint64)
+    return _spread_bits(q[:, 0]) | (_spread_bits(q[:, 1]) << np.uint64(1))
+
+
+def _bounding_square(xy):
+    lo = xy.min(axis=0)
+    size = float((xy.max(axis=0) - lo).max())
+    # widen slightly so the largest coordinate still falls inside the last cell
+    size = size * (1 + 1e-9) + 1e-12
+    return lo, size
+
+
+class LensTree:
+    """Quadtree with multipole expansions over point lenses (N, >=3: x, y, Re)."""
+
+    def __init__(self, lenses, leaf_size=16, order=8, max_depth=MORTON_BITS):
+        lenses = np.asarray(lenses, dtype=np.float64)
+        self.order = order
+        self.leaf_size = leaf_size
+        self.levels = []
+        if not len(lenses):
+            # an empty field has no nodes; deflection() is zero everywhere
+            self.z, self.m = np.zeros(0, dtype=np.complex128), np.zeros(0)
+            return
+        lo, size = _bounding_square(lenses[:, :2])
+        codes = morton_codes(lenses[:, :2], lo, size, max_depth)
+        perm = np.argsort(codes, kind='stable')
+        codes = codes[perm]
+        self.z = lenses[perm, 0] + 1j * lenses[perm, 1]
+        self.m = lenses[perm, 2] ** 2
+        n = len(self.z)
+        # one dict of node arrays per level; lenses of a node are the contiguous slice start:start+count
+        prefix_prev = None
+        for level in range(max_depth + 1):
+            prefix = codes >> np.uint64(2 * (max_depth - level))
+            start = np.flatnonzero(np.r_[True, prefix[1:] != prefix[:-1]])
+            count = np.diff(np.r_[start, n])
+            node = self._node_arrays(start, count)
+            node['prefix'] = prefix[start]
+            node['leaf'] = (count <= leaf_size) | (level == max_depth)
+            if prefix_prev is not None:
+                # children of the previous level's nodes are contiguous runs of this level's nodes
+                parent = self.levels[-1]
+                parent['child_lo'] = np.searchsorted(node['prefix'] >> np.uint64(2), prefix_prev, side='left')
+                parent['child_hi'] = np.searchsorted(node['prefix'] >> np.uint64(2), prefix_prev, side='right')
+            self.levels.append(node)
+            prefix_prev = node['prefix']
+            if node['leaf'].all():
+                break
+
+    def _node_arrays(self, start, count):
+        owner = np.repeat(np.arange(len(start)), count)
+        mass = np.add.reduceat(self.m, start)
+        mean = np.add.reduceat(self.z, start) / count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            com = np.add.reduceat(self.m * self.z, start) / mass
+        centre = np.where(mass > 0, com, mean)
+        d = self.z - centre[owner]
+        radius = np.maximum.reduceat(np.abs(d), start)
+        coeffs = np.empty((self.order + 1, len(start)), dtype=np.complex128)
+        term = self.m.astype(np.complex128)
+        for p in range(self.order + 1):
+            coeffs[p] = np.add.reduceat(term, start)
+            term = term * d
+        return {'start': start, 'count': count, 'centre': centre, 'radius': radius, 'coeffs': coeffs}
+
+    def _far(self, node, pairs_b, pairs_n, pts, f, chunk):
+        """f[b] += multipole expansions of nodes pairs_n at batches pairs_b (pairs sorted by batch)."""
+        T = pts.shape[1]
+        step = max(1, chunk // T)
+        coeffs, centre = node['coeffs'], node['centre']
+        for s in range(0, len(pairs_b), step):
+            b, n = pairs_b[s:s + step], pairs_n[s:s + step]
+            inv = 1.0 / (pts[b] - centre[n][:, None])
+            acc = np.broadcast_to(coeffs[self.order][n][:, None], inv.shape)
+            for p in range(self.order - 1, -1, -1):
+                acc = acc * inv + coeffs[p][n][:, None]
+            self._accumulate(f, b, acc * inv)
+
+    def _near(self, node, pairs_b, pairs_n, pts, alpha, chunk):
+        """alpha[b] += direct (softened) sums over the lenses of leaves pairs_n."""
+        count = node['count'][pairs_n]
+        b = np.repeat(pairs_b, count)
+        first = np.repeat(node['start'][pairs_n], count)
+        lens = first + np.arange(len(b)) - np.repeat(np.cumsum(count) - count, count)
+        T = pts.shape[1]
+        step = max(1, chunk // T)
+        for s in range(0, len(b), step):
+            bb, ll = b[s:s + step], lens[s:s + step]
+            d = pts[bb] - self.z[ll][:, None]
+            self._accumulate(alpha, bb, self.m[ll][:, None] * d / (d.real**2 + d.imag**2 + 1e-8))
+
+    @staticmethod
+    def _accumulate(out, b, values):
+        # b is sorted, so each batch's rows are one contiguous run
+        first = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+        out[b[first]] += np.add.reduceat(values, first, axis=0)
+
+    def deflection(self, uv, theta=0.5, batch=64, chunk=1 << 22):
+        """Deflection (P, 2) at points uv (P, 2); theta is the opening angle, 0 for the exact sum."""
+        uv = np.asarray(uv, dtype=np.float64)
+        P = len(uv)
+        if P == 0 or len(self.z) == 0:
+            return np.zeros((P, 2))
+        # batches of `batch` consecutive points in Morton order have small bounding boxes
+        lo, size = _bounding_square(uv)
+        order = np.argsort(morton_codes(uv, lo, size), kind='stable')
+        nb = -(-P // batch)
+        idx = np.concatenate([order, np.repeat(order[-1:], nb * batch - P)]).reshape(nb, batch)
+        pts = uv[idx, 0] + 1j * uv[idx, 1]
+        box_lo = np.stack([pts.real.min(axis=1), pts.imag.min(axis=1)], axis=1)
+        box_hi = np.stack([pts.real.max(axis=1), pts.imag.max(axis=1)], axis=1)
+
+        f = np.zeros(pts.shape, dtype=np.complex128)       # far field, alpha = conj(f)
+        alpha = np.zeros(pts.shape, dtype=np.complex128)   # near field, alpha directly
+        pairs_b = np.arange(nb)
+        pairs_n = np.zeros(nb, dtype=np.int64)
+        for node in self.levels:
+            if not len(pairs_b):
+                break
+            c = node['centre'][pairs_n]
+            dx = np.maximum(np.maximum(box_lo[pairs_b, 0] - c.real, c.real - box_hi[pairs_b, 0]), 0.0)
+            dy = np.maximum(np.maximum(box_lo[pairs_b, 1] - c.imag, c.imag - box_hi[pairs_b, 1]), 0.0)
+            dist = np.hypot(dx, dy)
+            far = (node['radius'][pairs_n] < theta * dist) if theta > 0 else np.zeros(len(pairs_b), bool)
+            self._far(node, pairs_b[far], pairs_n[far], pts, f, chunk)
+            leaf = ~far & node['leaf'][pairs_n]
+            self._near(node, pairs_b[leaf], pairs_n[leaf], pts, alpha, chunk)
+            # open the rest: every child of each remaining node, keeping the pairs sorted by batch
+            rest = ~far & ~leaf
+            b, n = pairs_b[rest], pairs_n[rest]
+            if not len(b):
+                break
+            lo_c, hi_c = node['child_lo'][n], node['child_hi'][n]
+            k = hi_c - lo_c
+            pairs_b = np.repeat(b, k)
+            pairs_n = np.repeat(lo_c, k) + np.arange(k.sum()) - np.repeat(np.cumsum(k) - k, k)
+
+        # the padding duplicates sit after the first P entries
+        total = (np.conj(f) + alpha).reshape(-1)[:P]
+        out = np.empty((P, 2))
+        out[order, 0], out[order, 1] = total.real, total.imag
+        return out
+
+
+def render(W, H, lenses, background, bg_scale=1.0, theta=0.5, leaf_size=16, order=8, batch=64,
+           chunk=1 << 22, tree=None):
+    """lensing_cpu.render with the tree deflection; pass a prebuilt `tree` to reuse it across frames."""
+    if tree is None:
+        tree = LensTree(lenses, leaf_size, order)
+    py, px = np.mgrid[0:H, 0:W]
+    uv = np.stack([(px + 0.5) / W, (py + 0.5) / H], axis=-1).reshape(-1, 2)
+    src = uv - tree.deflection(uv, theta, batch, chunk)
+    bg_uv = np.mod(src * bg_scale, 1.0)
+    return lensing_cpu.sample_bilinear(background, bg_uv).reshape(H, W, -1).astype(np.float32)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Crowded-field thin-lens render with a Barnes-Hut lens tree')
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=600)
+    parser.add_argument('--lenses', type=int, default=100000, help='random field of N point lenses')
+    parser.add_argument('--lens-re', type=float, default=0.0005, help='Einstein radius of the field lenses')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--theta', type=float, default=0.5, help='opening angle (0: exact direct sum)')
+    parser.add_argument('--order', type=int, default=8, help='multipole order')
+    parser.add_argument('--leaf-size', type=int, default=16, help='lenses per leaf summed directly')
+    parser.add_argument('--batch', type=int, default=64, help='points per tree walk')
+    parser.add_argument('--background', default=None, help='background image (default: seeded starfield)')
+    parser.add_argument('--bg-scale', type=float, default=1.0)
+    parser.add_argument('--out', default='lensing_tree.png')
+    args = parser.parse_args(argv)
+
+    lenses = lensing_cpu.star_field(args.lenses, args.lens_re, args.seed)
+    if args.background:
+        background = np.asarray(Image.open(args.background).convert('RGB'), dtype=np.float32) / 255
+    else:
+        background = lensing_cpu.starfield_background(seed=args.seed)
+    t0 = time.perf_counter()
+    tree = LensTree(lenses, args.leaf_size, args.order)
+    t1 = time.perf_counter()
+    frame = render(args.width, args.height, lenses, background, args.bg_scale, args.theta,
+                   batch=args.batch, tree=tree)
+    t2 = time.perf_counter()
+    print(f'{len(lenses)} lenses: tree {t1 - t0:.2f}s ({len(tree.levels)} levels), '
+          f'{args.width}x{args.height} render {t2 - t1:.2f}s')
+    lensing_cpu.to_image(frame).save(args.out)
+    print('Saved', args.out)
+
+
+if __name__ == '__main__':
+    main()
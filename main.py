@@ -7,16 +7,30 @@ Keys:
 - C: cycle active lens (multi mode)
 - Q/E: decrease/increase Re of active lens
 - U/O: decrease/increase Re of lens 1 (legacy)
-- + / - : add / remove lens (multi mode)
+- + / - : add / remove lens (multi mode, no cap)
 - T/G: background scale up/down
-- S: save screenshot
+- S: save screenshot (screenshot_NNNN.png, read back asynchronously)
+- R: start/stop recording every frame to capture/frame_NNNNN.png
 - ESC: exit
+The compute passes only re-run after a key changes the lenses or background;
+otherwise the loop sleeps in glfw.wait_events.  The summed deflection is kept
+in a field texture (lens_field.py): an edit sums only the changed lenses, and
+a background-scale change only redoes the background lookup.
+Options:
+    --capture-format rgba8|srgb8|half (half saves float16 .npy)
+    --lenses N [--lens-re RE] [--seed S]: add a static random field of N point lenses
+    --far-theta T: sum lenses farther than (tile size)/T as one per-tile far field (0: exact)
 """
+import argparse
 import sys, os
 import glfw
 import moderngl
 import numpy as np
-from PIL import Image
+
+import frame_capture
+import lens_field
+import lensing_cpu
+import sky_background
 
 DEMO_DIR = os.path.dirname(__file__)
 SHADER_DIR = os.path.join(DEMO_DIR, 'shaders')
@@ -27,21 +41,8 @@ def load_shader(ctx, path):
     with open(path, 'r', encoding='utf-8') as f:
         return f.read()
 
-def make_background(size=(1024,512)):
-    # procedural starfield
-    W,H = size
-    img = Image.new('RGB', (W,H), (0,0,10))
-    px = img.load()
-    import random
-    for _ in range(8000):
-        x = random.randrange(W)
-        y = random.randrange(H)
-        b = random.randint(150,255)
-        px[x,y] = (b,b,b)
-    return img
-
 class Demo:
-    def __init__(self):
+    def __init__(self, capture_format='rgba8', field=None, far_theta=0.0, bg_seed=0):
         if not glfw.init():
             raise RuntimeError('glfw init failed')
         glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 4)
@@ -50,12 +51,9 @@ class Demo:
         if not self.win:
             glfw.terminate(); raise RuntimeError('window')
         glfw.make_context_current(self.win)
+        glfw.swap_interval(1)
         self.ctx = moderngl.create_context()
 
-        # create compute shader
-        comp_src = load_shader(self.ctx, os.path.join(SHADER_DIR, 'lensing.comp'))
-        self.comp = self.ctx.compute_shader(comp_src)
-
         # fullscreen quad program
         vert = load_shader(self.ctx, os.path.join(SHADER_DIR, 'quad.vert'))
         frag = load_shader(self.ctx, os.path.join(SHADER_DIR, 'quad.frag'))
@@ -71,11 +69,24 @@ class Demo:
         self.tex.filter = (moderngl.LINEAR, moderngl.LINEAR)
 
         # background texture
-        bg_img = make_background((1024,512))
-        self.bg = self.ctx.texture(bg_img.size, 3, bg_img.tobytes())
+        # seeded procedural starfield, generated once and then mapped from sky_cache/
+        bg_img = sky_background.cached_starfield((1024, 512), seed=bg_seed)
+        self.bg = self.ctx.texture((bg_img.shape[1], bg_img.shape[0]), 3, bg_img.tobytes())
         self.bg.build_mipmaps()
         self.bg.use(location=0)
 
+        # screenshots and recordings are read back through PBOs and encoded off the render thread;
+        # texture row 0 is the bottom of the window, so rows are flipped into image order
+        self.capture = frame_capture.FrameCapture(self.ctx, (WIDTH, HEIGHT), capture_format, flip=True)
+        self.shots = 0
+        self.shot_requested = False
+        self.recording = False
+        self.recorded = 0
+
+        # deflection of the static field plus the editable lenses, updated per edit
+        self.deflection = lens_field.DeflectionField(self.ctx, (WIDTH, HEIGHT), field, far_theta)
+        self.needs_present = True
+
         # lens params: start with two lenses
         self.lens_pos = [np.array([0.45,0.5], dtype='f4'), np.array([0.55,0.5], dtype='f4')]
         self.lens_re  = [0.06, 0.06]
@@ -84,8 +95,9 @@ class Demo:
         self.active_idx = 0
 
         glfw.set_key_callback(self.win, self.on_key)
+        glfw.set_window_refresh_callback(self.win, self.on_refresh)
 
-        print('Controls: N single, M multi, C cycle active, +/- add/remove, arrows move active, Q/E Re -,/+, T/G bg scale, S screenshot')
+        print('Controls: N single, M multi, C cycle active, +/- add/remove, arrows move active, Q/E Re -,/+, T/G bg scale, S screenshot, R record')
 
     def on_key(self, win, key, sc, action, mods):
         if action == glfw.PRESS or action == glfw.REPEAT:
@@ -115,11 +127,10 @@ class Demo:
                 return
             # add / remove lens (multi mode)
             if key == glfw.KEY_KP_ADD or key == glfw.KEY_EQUAL:
-                if len(self.lens_pos) < 8:
-                    self.lens_pos.append(np.array([0.5,0.5], dtype='f4'))
-                    self.lens_re.append(0.02)
-                    self.active_idx = len(self.lens_pos)-1
-                    print('Lens added, count=', len(self.lens_pos))
+                self.lens_pos.append(np.array([0.5,0.5], dtype='f4'))
+                self.lens_re.append(0.02)
+                self.active_idx = len(self.lens_pos)-1
+                print('Lens added, count=', len(self.lens_pos))
                 return
             if key == glfw.KEY_KP_SUBTRACT or key == glfw.KEY_MINUS:
                 if len(self.lens_pos) > 1:
@@ -131,11 +142,14 @@ class Demo:
                 return
             # screenshot
             if key == glfw.KEY_S:
-                data = self.tex.read()
-                img = Image.frombytes('RGBA', (WIDTH, HEIGHT), data)
-                img = img.convert('RGB')
-                img.save('screenshot.png')
-                print('Saved screenshot.png')
+                # taken after the next dispatch by the render loop
+                self.shot_requested = True
+                return
+            if key == glfw.KEY_R and action == glfw.PRESS:
+                self.recording = not self.recording
+                if self.recording:
+                    os.makedirs('capture', exist_ok=True)
+                print('Recording ->', 'ON' if self.recording else f'OFF ({self.recorded} frames)')
                 return
 
             # movement keys apply to active lens (multi) or lens 0 (single)
@@ -161,75 +175,76 @@ class Demo:
             if key == glfw.KEY_G:
                 self.bg_scale /= 1.1
 
-    def update_uniforms(self):
-        # send lens count
-        lens_count = len(self.lens_pos)
-        try:
-            self.comp['u_lens_count'] = int(lens_count)
-        except Exception:
-            pass
-        # pad to MAX_LENSES (8)
-        pos_flat = []
-        re_flat = []
-        for i in range(8):
-            if i < len(self.lens_pos):
-                pos_flat.extend([float(self.lens_pos[i][0]), float(self.lens_pos[i][1])])
-                re_flat.append(float(self.lens_re[i]))
-            else:
-                pos_flat.extend([0.0, 0.0])
-                re_flat.append(0.0)
-        # try per-element writes
-        wrote = False
-        try:
-            for i in range(8):
-                self.comp[f'u_lens_pos_flat[{i}]'].value = (pos_flat[2*i], pos_flat[2*i+1])
-                self.comp[f'u_lens_re_flat[{i}]'].value = re_flat[i]
-            wrote = True
-        except Exception:
-            wrote = False
-        if not wrote:
-            try:
-                for i in range(8):
-                    self.comp.uniforms.get(f'u_lens_pos_flat[{i}]').value = (pos_flat[2*i], pos_flat[2*i+1])
-            except Exception:
-                pass
-        try:
-            self.comp['u_bg_scale'] = float(self.bg_scale)
-        except Exception:
-            pass
+    def lens_state(self):
+        """Everything the compute pass depends on; a change means the image is stale."""
+        return (tuple((float(p[0]), float(p[1])) for p in self.lens_pos), tuple(self.lens_re), self.bg_scale)
+
+    def dispatch(self):
+        n = len(self.lens_pos)
+        lenses = np.zeros((n, 3), dtype='f4')
+        lenses[:, :2] = np.reshape(self.lens_pos, (n, 2))
+        lenses[:, 2] = self.lens_re
+        # sums only the lenses that changed since the last dispatch (nothing for a bg scale change)
+        self.deflection.update(lenses)
+        self.deflection.compose(self.tex, self.bg, self.bg_scale)
+
+    def present(self):
+        self.tex.use(location=0)
+        self.prog['tex'] = 0
+        self.ctx.clear(0.0,0.0,0.0)
+        self.vao.render(moderngl.TRIANGLE_STRIP)
+        glfw.swap_buffers(self.win)
+
+    def on_refresh(self, win):
+        # window exposed or resized: re-present, the image itself is still valid
+        self.needs_present = True
 
     def run(self):
+        rendered = None
         while not glfw.window_should_close(self.win):
-            glfw.poll_events()
-
-            # update uniforms
-            self.update_uniforms()
-
-            # bind image and background
-            self.ctx.bindings = []
-            # write to image unit 0
-            self.ctx.bind_image(0, self.tex, read=False, write=True)
-            # background in location 0
-            self.bg.use(location=0)
-
-            # dispatch compute
-            gx = (WIDTH + 7)//8
-            gy = (HEIGHT + 7)//8
-            self.comp.run(group_x=gx, group_y=gy, group_z=1)
-
-            # memory barrier
-            self.ctx.memory_barrier()
-
-            # draw quad
-            self.tex.use(location=0)
-            self.prog['tex'] = 0
-            self.ctx.clear(0.0,0.0,0.0)
-            self.vao.render(moderngl.TRIANGLE_STRIP)
-
-            glfw.swap_buffers(self.win)
-
+            # sleep until input unless frames are being recorded or captures are still in flight
+            if self.recording:
+                glfw.poll_events()
+            elif self.capture.pending:
+                glfw.wait_events_timeout(1 / 60)
+            else:
+                glfw.wait_events()
+
+            state = self.lens_state()
+            if state != rendered:
+                self.dispatch()
+                rendered = state
+                self.needs_present = True
+
+            if self.shot_requested:
+                path = f'screenshot_{self.shots:04d}.png'
+                self.capture.capture(self.tex, path)
+                self.shots += 1
+                self.shot_requested = False
+                print('Saving', path)
+            if self.recording:
+                self.capture.capture(self.tex, os.path.join('capture', f'frame_{self.recorded:05d}.png'))
+                self.recorded += 1
+                self.needs_present = True  # paced by the swap interval
+
+            if self.needs_present:
+                self.present()
+                self.needs_present = False
+            self.capture.poll()
+
+        self.capture.close()
         glfw.terminate()
 
 if __name__ == '__main__':
-    d = Demo()
+    parser = argparse.ArgumentParser(description='Binary-lens compute shader demo')
+    parser.add_argument('--capture-format', choices=sorted(frame_capture.FORMATS), default='rgba8',
+                        help="screenshot/recording format; 'half' saves float16 .npy")
+    parser.add_argument('--lenses', type=int, default=0, help='static random field of N point lenses')
+    parser.add_argument('--lens-re', type=float, default=0.002, help='Einstein radius of the field lenses')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the lens field and the background starfield')
+    parser.add_argument('--far-theta', type=float, default=0.0,
+                        help='per-tile far-field opening ratio (0: sum every lens exactly; 0.25 is close)')
+    args = parser.parse_args()
+    field = lensing_cpu.star_field(args.lenses, args.lens_re, args.seed) if args.lenses else None
+    d = Demo(args.capture_format, field, args.far_theta, bg_seed=args.seed)
     d.run()
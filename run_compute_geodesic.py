@@ -1,36 +1,207 @@
-"""Run the compute shader `geodesic_rk4.comp` using moderngl offscreen context and save output.
+"""Headless compute-shader renderer for `geodesic_rk4.comp` and `geodesic_schwarzschild.comp`.
+
+Without --camera the 1D-profile shader `geodesic_rk4.comp` runs per pixel.  With
+--camera pinhole|equirect|profile `geodesic_schwarzschild.comp` integrates one ray
+per unique radius into a radial table, then shades the whole image from it.
+
+`ComputeRenderer` keeps one GL context, the compiled programs and the textures
+alive across renders.  Every frame is dispatched in sub-image tiles (the
+u_offset uniform) with a finish after each one, so no single dispatch runs long
+enough to trip a GPU watchdog and progress is reported per tile.  Every shader
+parameter is on the command line.  Without a display the renderer falls back to
+an EGL context; --software selects Mesa's llvmpipe for machines without a GPU.
+The result is converted on the GPU and read back as 8-bit (--format rgba8 or
+srgb8) or half floats (--format half, saved as .npy) with frame_capture.py.
+
+Usage:
+    python run_compute_geodesic.py --camera pinhole --tile 64 --tol 1e-3
+    python run_compute_geodesic.py --software --width 400 --height 200 --method dopri5 --rtol 1e-6
 """
-import moderngl
-from PIL import Image
-import numpy as np
+import argparse
+import math
 import os
+import time
+
+import frame_capture
 
 DIR = os.path.dirname(__file__)
 SHADER = os.path.join(DIR, 'shaders', 'geodesic_rk4.comp')
+CAMERA_SHADER = os.path.join(DIR, 'shaders', 'geodesic_schwarzschild.comp')
+CAMERA_IDS = {'profile': 0, 'pinhole': 1, 'equirect': 2}
+METHOD_IDS = {'rk4': 0, 'dopri5': 1}
+
+
+def create_context(backend=None, software=False):
+    """Standalone GL 4.3 context; tries the default backend, then EGL (no display needed)."""
+    if software:
+        os.environ.setdefault('LIBGL_ALWAYS_SOFTWARE', '1')
+        os.environ.setdefault('GALLIUM_DRIVER', 'llvmpipe')
+    import moderngl
+    if backend:
+        return moderngl.create_standalone_context(require=430, backend=backend)
+    try:
+        return moderngl.create_standalone_context(require=430)
+    except Exception:
+        return moderngl.create_standalone_context(require=430, backend='egl')
+
+
+class ComputeRenderer:
+    """One GL context, compiled programs and textures reused across renders."""
+
+    def __init__(self, backend=None, software=False):
+        self.ctx = create_context(backend, software)
+        self.programs = {}
+        self.textures = {}
+        self.captures = {}
+
+    @property
+    def renderer(self):
+        return self.ctx.info['GL_RENDERER']
+
+    def program(self, path):
+        if path not in self.programs:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.programs[path] = self.ctx.compute_shader(f.read())
+        return self.programs[path]
+
+    def texture(self, name, size, components):
+        key = (name, size, components)
+        if key not in self.textures:
+            self.textures[key] = self.ctx.texture(size, components, dtype='f4')
+        return self.textures[key]
+
+    @staticmethod
+    def set_uniforms(comp, **values):
+        # uniforms a shader does not use are optimized away; skip them
+        for name, value in values.items():
+            uniform = comp.get(name, None)
+            if uniform is not None:
+                uniform.value = value
+
+    def dispatch_tiles(self, comp, W, H, tile=64, progress=None):
+        """Run `comp` over a W x H image one tile at a time, waiting for each tile to finish."""
+        tile = max(8, tile // 8 * 8)  # whole 8x8 workgroups, so tiles do not overlap
+        tiles = [(x0, y0) for y0 in range(0, H, tile) for x0 in range(0, W, tile)]
+        for i, (x0, y0) in enumerate(tiles):
+            t0 = time.perf_counter()
+            comp['u_offset'] = (x0, y0)
+            comp.run(group_x=(min(tile, W - x0) + 7)//8, group_y=(min(tile, H - y0) + 7)//8, group_z=1)
+            self.ctx.finish()
+            if progress:
+                progress(i + 1, len(tiles), (x0, y0), time.perf_counter() - t0)
+
+    def dispatch_radial(self, comp, n, chunk=4096, progress=None):
+        """Fill an n-texel radial table in chunks of `chunk` texels (pass 0)."""
+        chunk = max(64, chunk // 64 * 64)
+        starts = list(range(0, n, chunk))
+        for i, start in enumerate(starts):
+            t0 = time.perf_counter()
+            comp['u_offset'] = (start, 0)
+            comp.run(group_x=(min(chunk, n - start) + 63)//64, group_y=1, group_z=1)
+            self.ctx.finish()
+            if progress:
+                progress(i + 1, len(starts), (start, 0), time.perf_counter() - t0)
+
+    def render(self, W=800, H=400, camera='none', r_s=1.0, r_obs=100.0, b_scale=6.0, step_phi=0.01,
+               tol=1e-3, rtol=0.0, min_step=1e-5, max_step=0.1, max_steps=20000, method='rk4', tile=64,
+               progress=None):
+        """Render one frame; returns the rgba32f output texture (owned and reused by the renderer).
+
+        method and rtol only exist in geodesic_rk4.comp (camera='none'); the camera shader is RK4 step doubling.
+        """
+        if camera != 'none' and (method != 'rk4' or rtol):
+            raise ValueError(f'camera {camera!r} supports only method rk4 without rtol')
+        tex = self.texture('out', (W, H), 4)
+        tex.bind_to_image(0, read=False, write=True)
+        comp = self.program(SHADER if camera == 'none' else CAMERA_SHADER)
+        self.set_uniforms(comp, u_r_s=r_s, u_r_obs=r_obs, u_b_scale=b_scale, u_step_phi=step_phi, u_tol=tol,
+                          u_rtol=rtol, u_min_step=min_step, u_max_step=max_step, u_max_steps=max_steps,
+                          u_method=METHOD_IDS[method])
+        if camera == 'none':
+            self.dispatch_tiles(comp, W, H, tile, progress)
+            return tex
+        if camera == 'equirect':
+            b_max = r_obs / math.sqrt(1.0 - r_s / r_obs)
+        elif camera == 'pinhole':
+            b_max = b_scale * math.hypot(1.0, H / W)
+        else:
+            b_max = b_scale
+        # one texel per half pixel of screen radius
+        n = 2 * int(math.ceil(math.hypot(W, H))) + 1
+        radial = self.texture('radial', (n, 1), 2)
+        radial.bind_to_image(1, read=True, write=True)
+        self.set_uniforms(comp, u_camera=CAMERA_IDS[camera], u_b_max=b_max, u_pass=0)
+        self.dispatch_radial(comp, n, tile * tile, progress)
+        self.ctx.memory_barrier()
+        comp['u_pass'] = 1
+        self.dispatch_tiles(comp, W, H, tile, progress)
+        return tex
+
+    def read_image(self, tex, fmt='rgba8'):
+        """(H, W, 4) array of `tex` in a frame_capture format ('rgba8', 'srgb8' or 'half')."""
+        if fmt not in self.captures:
+            self.captures[fmt] = frame_capture.FrameCapture(self.ctx, tex.size, fmt, buffers=1, encoders=0)
+        return self.captures[fmt].read(tex)
+
+    def release(self):
+        for capture in self.captures.values():
+            capture.close()
+        for tex in self.textures.values():
+            tex.release()
+        for comp in self.programs.values():
+            comp.release()
+        self.ctx.release()
+
+
+def print_progress(done, total, origin, seconds):
+    end = '\n' if done == total else '\r'
+    print(f'  tile {done}/{total} at {origin}  {seconds*1000:.0f} ms      ', end=end, flush=True)
 
-W,H = 800,400
 
-ctx = moderngl.create_standalone_context()
-with open(SHADER, 'r', encoding='utf-8') as f:
-    src = f.read()
-comp = ctx.compute_shader(src)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='GPU RK4 equatorial null-geodesic renderer')
+    parser.add_argument('--camera', choices=['none', 'profile', 'pinhole', 'equirect'], default='none',
+                        help='none: geodesic_rk4.comp 1D profile (default); otherwise geodesic_schwarzschild.comp')
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=400)
+    parser.add_argument('--r-s', type=float, default=1.0, help='Schwarzschild radius (u_r_s)')
+    parser.add_argument('--r-obs', type=float, default=100.0, help='observer radius (u_r_obs)')
+    parser.add_argument('--b-scale', type=float, default=6.0, help='impact parameter at the screen edge (u_b_scale)')
+    parser.add_argument('--step-phi', type=float, default=0.01, help='initial phi step (u_step_phi)')
+    parser.add_argument('--tol', type=float, default=1e-3, help='absolute local error tolerance in r (u_tol)')
+    parser.add_argument('--rtol', type=float, default=0.0, help='relative tolerance (u_rtol, dopri5; --camera none only)')
+    parser.add_argument('--min-step', type=float, default=1e-5, help='smallest phi step (u_min_step)')
+    parser.add_argument('--max-step', type=float, default=0.1, help='largest phi step (u_max_step)')
+    parser.add_argument('--max-steps', type=int, default=20000, help='step budget per ray (u_max_steps)')
+    parser.add_argument('--method', choices=sorted(METHOD_IDS), default='rk4', help='stepper (u_method; dopri5 needs --camera none)')
+    parser.add_argument('--tile', type=int, default=64, help='tile edge in pixels per dispatch')
+    parser.add_argument('--backend', default=None, help="moderngl context backend, e.g. 'egl' for no display")
+    parser.add_argument('--software', action='store_true', help='force Mesa llvmpipe software rendering')
+    parser.add_argument('--repeat', type=int, default=1, help='render N times on the same context (timing)')
+    parser.add_argument('--format', choices=sorted(frame_capture.FORMATS), default='rgba8',
+                        help="readback format; 'half' saves a float16 .npy next to --out")
+    parser.add_argument('--out', default=None, help='output PNG')
+    return parser.parse_args(argv)
 
-tex = ctx.texture((W,H), 4, dtype='f4')
-ctx.bind_image(0, tex, read=False, write=True)
 
-comp['u_r_s'] = 1.0
-comp['u_r_obs'] = 100.0
-comp['u_b_scale'] = 6.0
-comp['u_step_phi'] = 0.01
-comp['u_max_steps'] = 20000
+def main(argv=None):
+    args = parse_args(argv)
+    if args.camera != 'none' and (args.method != 'rk4' or args.rtol):
+        raise SystemExit('--method dopri5 and --rtol need --camera none; the camera shader only steps RK4')
+    renderer = ComputeRenderer(args.backend, args.software)
+    print(f'GL renderer: {renderer.renderer}')
+    params = dict(camera=args.camera, r_s=args.r_s, r_obs=args.r_obs, b_scale=args.b_scale,
+                  step_phi=args.step_phi, tol=args.tol, rtol=args.rtol, min_step=args.min_step,
+                  max_step=args.max_step, max_steps=args.max_steps, method=args.method, tile=args.tile)
+    for i in range(args.repeat):
+        t0 = time.perf_counter()
+        tex = renderer.render(args.width, args.height, progress=print_progress, **params)
+        print(f'Render {i + 1}/{args.repeat}: {time.perf_counter() - t0:.2f}s')
+    out_name = args.out or ('geodesic_compute_out.png' if args.camera == 'none'
+                            else f'geodesic_compute_{args.camera}.png')
+    print('Saved', frame_capture.save_array(renderer.read_image(tex, args.format), out_name, args.format))
+    renderer.release()
 
-gx = (W + 7)//8
-gy = (H + 7)//8
-comp.run(group_x=gx, group_y=gy, group_z=1)
-ctx.memory_barrier()
 
-data = tex.read()
-img = Image.frombytes('RGBA', (W,H), data)
-img = img.convert('RGB')
-img.save('geodesic_compute_out.png')
-print('Saved geodesic_compute_out.png')
+if __name__ == '__main__':
+    main()
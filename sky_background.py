@@ -0,0 +1,223 @@
+"""Background assets: seeded starfields and memory-mapped equirectangular sky maps.
+
+- `starfield` draws the demo's procedural starfield (main.py) with array
+  writes from a seeded generator; `cached_starfield` keeps it in
+  `sky_cache/` as a raw .npy and maps it back on later starts.
+- `SkyMap` serves a large equirectangular sky image (16k x 8k and up)
+  from a mip chain of raw uint8 .npy files in `sky_cache/`, each opened
+  with np.load(mmap_mode='r').  The image is decoded and the levels are
+  built once (`convert`, 2x2 box filter in row strips); afterwards opening
+  a map reads only the .json header, and sampling touches only the pages
+  it needs.  Levels are keyed by the source path, size and mtime.
+- `SkyMap.sample` is a batched bilinear lookup (longitude wraps, latitude
+  clamps) over whole arrays of sky directions, in bounded chunks.  A
+  SkyMap is callable as sky(lon, lat) -> uint8 colours, the `sky` hook of
+  geodesic_camera.render, and pickles by path so tile workers map the same
+  files instead of copying them.
+
+Longitude 0 is the centre column and latitude +pi/2 the top row, matching
+geodesic_camera.sky_direction (the undeflected central ray lands at
+lon = lat = 0).
+
+Usage:
+    sky = SkyMap.open('milkyway_16k.png')        # converts on first use
+    img = geodesic_camera.render(W, H, r_obs, b_scale, camera='pinhole', sky=sky)
+    python sky_background.py milkyway_16k.png --sample 1000000
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+import numpy as np
+from PIL import Image
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(DIR, 'sky_cache')
+
+# bump when the level layout or the filter changes
+SKY_VERSION = 1
+
+
+def starfield(size=(1024, 512), stars=8000, seed=0):
+    """(H, W, 3) uint8 starfield: dark blue with `stars` grey stars of brightness 150-255."""
+    W, H = size
+    rng = np.random.default_rng(seed)
+    img = np.zeros((H, W, 3), dtype=np.uint8)
+    img[..., 2] = 10
+    b = rng.integers(150, 256, stars).astype(np.uint8)
+    img[rng.integers(0, H, stars), rng.integers(0, W, stars)] = b[:, None]
+    return img
+
+
+def _save_npy(path, arr):
+    tmp = f'{path}.{os.getpid()}.tmp.npy'
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+
+
+def cached_starfield(size=(1024, 512), stars=8000, seed=0, cache_dir=CACHE_DIR):
+    """`starfield` loaded (memory-mapped) from cache_dir, generating and saving it if needed."""
+    W, H = size
+    path = os.path.join(cache_dir, f'starfield_{W}x{H}_{stars}_{seed}_v{SKY_VERSION}.npy')
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        _save_npy(path, starfield(size, stars, seed))
+    return np.load(path, mmap_mode='r')
+
+
+def _source_key(path):
+    st = os.stat(path)
+    blob = json.dumps({'path': os.path.abspath(path), 'size': st.st_size, 'mtime': st.st_mtime_ns,
+                       'version': SKY_VERSION}, sort_keys=True)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()[:16]
+
+
+def _write_level0(image_path, out_path, rows):
+    """Copy the source image into a uint8 (H, W, 3) .npy, `rows` rows at a time."""
+    if image_path.endswith('.npy'):
+        src = np.load(image_path, mmap_mode='r')
+        H, W = src.shape[:2]
+        strip = lambda y0, y1: src[y0:y1, :, :3]
+    else:
+        # large panoramas trip Pillow's decompression-bomb guard; this is a trusted local file
+        limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+        try:
+            img = Image.open(image_path)
+            img = img.convert('RGB')
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+        W, H = img.size
+        strip = lambda y0, y1: np.asarray(img.crop((0, y0, W, y1)))
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.uint8, shape=(H, W, 3))
+    for y0 in range(0, H, rows):
+        out[y0:y0 + rows] = strip(y0, min(y0 + rows, H))
+    out.flush()
+    return out
+
+
+def downsample_half(src, out_path, rows=512):
+    """2x2 box-filtered .npy copy of a uint8 (H, W, 3) array (an odd last row/column is dropped).
+
+    Reads and writes `rows` output rows at a time, so src may be a memory map larger than RAM.
+    """
+    H, W = src.shape[0] // 2, src.shape[1] // 2
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.uint8, shape=(H, W, 3))
+    for y0 in range(0, H, rows):
+        y1 = min(y0 + rows, H)
+        block = src[2 * y0:2 * y1, :2 * W].astype(np.uint16)
+        s = block[0::2, 0::2] + block[0::2, 1::2] + block[1::2, 0::2] + block[1::2, 1::2]
+        out[y0:y1] = (s + 2) // 4
+    out.flush()
+    return out
+
+
+def convert(image_path, cache_dir=CACHE_DIR, min_size=16, rows=512):
+    """Build the mip chain of an equirectangular image in cache_dir; returns the header path."""
+    key = _source_key(image_path)
+    header = os.path.join(cache_dir, f'sky_{key}.json')
+    if os.path.exists(header):
+        return header
+    os.makedirs(cache_dir, exist_ok=True)
+    # the header is written last, so an interrupted conversion is simply redone
+    files = [f'sky_{key}_0.npy']
+    level = _write_level0(image_path, os.path.join(cache_dir, files[0]), rows)
+    while min(level.shape[:2]) // 2 >= min_size:
+        files.append(f'sky_{key}_{len(files)}.npy')
+        level = downsample_half(level, os.path.join(cache_dir, files[-1]), rows)
+    del level
+    meta = {'source': os.path.abspath(image_path), 'levels': files, 'version': SKY_VERSION}
+    with open(header + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(header + '.tmp', header)
+    return header
+
+
+class SkyMap:
+    """Equirectangular sky from a mip chain of memory-mapped uint8 levels (see `convert`)."""
+
+    def __init__(self, header, level=0):
+        self.header = header
+        self.level = level
+        with open(header, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        base = os.path.dirname(header)
+        self.levels = [np.load(os.path.join(base, name), mmap_mode='r') for name in self.meta['levels']]
+
+    @classmethod
+    def open(cls, image_path, cache_dir=CACHE_DIR, level=0):
+        """The map of image_path (PNG/JPEG/... or an (H, W, 3) uint8 .npy), converting it on first use."""
+        return cls(convert(image_path, cache_dir), level)
+
+    def __getstate__(self):
+        # pickles by reference: workers reopen the memory maps
+        return {'header': self.header, 'level': self.level}
+
+    def __setstate__(self, state):
+        self.__init__(state['header'], state['level'])
+
+    @property
+    def size(self):
+        """(W, H) of level 0."""
+        H, W = self.levels[0].shape[:2]
+        return W, H
+
+    def level_for(self, pixel_angle):
+        """Finest level whose texels are at least pixel_angle (radians) wide, for minification."""
+        texel = 2 * math.pi / self.size[0]
+        if pixel_angle <= texel:
+            return 0
+        return min(int(math.log2(pixel_angle / texel)), len(self.levels) - 1)
+
+    def sample(self, lon, lat, level=None, chunk=1 << 20):
+        """Bilinear colours (..., 3) float32 in [0, 255] at sky directions lon, lat (radians)."""
+        img = self.levels[self.level if level is None else level]
+        h, w = img.shape[:2]
+        lon, lat = np.broadcast_arrays(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        shape = lon.shape
+        lon, lat = lon.ravel(), lat.ravel()
+        out = np.empty((lon.size, 3), dtype=np.float32)
+        for s in range(0, lon.size, chunk):
+            x = (lon[s:s + chunk] / (2 * math.pi) + 0.5) * w - 0.5
+            y = np.clip((0.5 - lat[s:s + chunk] / math.pi) * h - 0.5, 0.0, h - 1.0)
+            x0, y0 = np.floor(x), np.floor(y)
+            fx = (x - x0).astype(np.float32)[:, None]
+            fy = (y - y0).astype(np.float32)[:, None]
+            x0 = x0.astype(np.int64) % w
+            y0 = y0.astype(np.int64)
+            x1, y1 = (x0 + 1) % w, np.minimum(y0 + 1, h - 1)
+            top = img[y0, x0] * (1 - fx) + img[y0, x1] * fx
+            bottom = img[y1, x0] * (1 - fx) + img[y1, x1] * fx
+            out[s:s + chunk] = top * (1 - fy) + bottom * fy
+        return out.reshape(shape + (3,))
+
+    def __call__(self, lon, lat):
+        """uint8 colours, the `sky` callable of geodesic_camera.shade."""
+        return np.rint(self.sample(lon, lat)).astype(np.uint8)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert an equirectangular sky image to memory-mapped mip levels')
+    parser.add_argument('image', help='equirectangular image (or (H, W, 3) uint8 .npy)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--sample', type=int, default=0, help='time a lookup of N random directions')
+    parser.add_argument('--level', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    sky = SkyMap.open(args.image, args.cache_dir, args.level)
+    print(f'{sky.size[0]}x{sky.size[1]} sky, {len(sky.levels)} levels, opened in {time.perf_counter() - t0:.2f}s '
+          f'({sky.header})')
+    if args.sample:
+        rng = np.random.default_rng(0)
+        lon = rng.uniform(-math.pi, math.pi, args.sample)
+        lat = np.arcsin(rng.uniform(-1.0, 1.0, args.sample))
+        t1 = time.perf_counter()
+        sky(lon, lat)
+        dt = time.perf_counter() - t1
+        print(f'{args.sample} lookups at level {args.level} in {dt:.3f}s ({dt / args.sample * 1e9:.0f} ns each)')
+
+
+if __name__ == '__main__':
+    main()